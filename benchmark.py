@@ -0,0 +1,231 @@
+from common import *
+from grid import Grid
+from grid_generator import GridGenerator
+from local_matrices_calculation import LocalMatricesCalculation
+from parallel_assembly import ParallelAssembly
+from system_of_equations import SystemOfEquations
+from vtk_writer import VtuWriter
+from datetime import datetime
+from time import perf_counter
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import tracemalloc
+import numpy as np
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+benchmarkPhasesNames: tuple[str] = ('gridParsing', 'localMatrices', 'globalAssembly', 'solve', 'outputWriting')
+
+def benchmarkLocalMatrices(n: int, grid: Grid, repeats: int = 3) -> dict:
+    '''
+    Compares per element and batched calculation of local matrices. Returns best times in seconds
+    and the biggest difference between results of both methods.
+    '''
+    times: dict = {}
+    results: list[np.ndarray] = []
+    for batched in (False, True):
+        best = float('inf')
+        for _ in range(repeats):
+            start = perf_counter()
+            LocalMatricesCalculation.calculate(n, grid, batched)
+            best = min(best, perf_counter() - start)
+        times['batched' if batched else 'perElement'] = best
+        results.append(np.array([[element.H, element.C, element.Hbc] for element in grid.elements]))
+    times['maxDifference'] = float(np.max(np.abs(results[0] - results[1])))
+    return times
+
+def runLocalMatricesComparison(sizes: list[int]) -> None:
+    '''
+    Prints timings of per element and batched local matrices calculation for several grid sizes.
+    '''
+    print(f'Elements    n   Per element [s]  Batched [s]  Speedup  Max diff')
+    for size in sizes:
+        grid = GridGenerator.createRectangular(size, size)
+        for n in (2, 4):
+            times = benchmarkLocalMatrices(n, grid)
+            print(f'{size*size:<12}{n:<4}{times["perElement"]:<17.4f}{times["batched"]:<13.4f}{times["perElement"]/times["batched"]:<9.1f}{times["maxDifference"]:.2e}')
+
+class PhaseTimer:
+    '''
+    Context manager measuring wall time and peak traced memory of a single phase.
+
+    phases:     dict of phase name -> {'time': seconds, 'peakMemory': bytes}
+    '''
+    def __init__(self, phases: dict, name: str):
+        self.phases: dict = phases
+        self.name: str = name
+
+    def __enter__(self):
+        tracemalloc.reset_peak()
+        self.start: float = perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        elapsed = perf_counter() - self.start
+        self.phases[self.name] = {'time': elapsed, 'peakMemory': tracemalloc.get_traced_memory()[1]}
+
+def benchmarkPhases(size: int, n: int, steps: int, workDir: str, solverOptions: dict) -> dict:
+    '''
+    Runs the whole pipeline on size x size grid and measures every phase separately:
+    grid parsing, local matrices, global assembly, a single solve step (mean of steps) and writing output of all steps.
+    '''
+    inputFilePath = os.path.join(workDir, f'grid{size}.txt')
+    if not os.path.isfile(inputFilePath):
+        GridGenerator.createRectangular(size, size, outputFilePath=inputFilePath)
+    phases: dict = {}
+    tracemalloc.start()
+    try:
+        with PhaseTimer(phases, 'gridParsing'):
+            grid = Grid.createFromFile(inputFilePath)
+        with PhaseTimer(phases, 'localMatrices'):
+            LocalMatricesCalculation.calculate(n, grid, batched=True)
+        with PhaseTimer(phases, 'globalAssembly'):
+            soe = SystemOfEquations(grid, **solverOptions)
+        temperatures: list[np.ndarray] = []
+        with PhaseTimer(phases, 'solve'):
+            for _ in range(steps):
+                temperatures.append(soe.solve())
+        phases['solve']['time'] /= steps
+        outputDir = os.path.join(workDir, 'output')
+        os.makedirs(outputDir, exist_ok=True)
+        with PhaseTimer(phases, 'outputWriting'):
+            writer = VtuWriter(outputDir, grid.nodeCoords, grid.connectivity)
+            for i, stepTemperatures in enumerate(temperatures):
+                writer.writeFrame(stepTemperatures, i + 1)
+            writer.close()
+    finally:
+        tracemalloc.stop()
+    return {
+        'elements': size*size,
+        'nodes': (size + 1)*(size + 1),
+        'n': n,
+        'steps': steps,
+        'phases': phases,
+        'maxRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024 if resource is not None else None
+    }
+
+def runPhaseBenchmark(sizes: list[int], orders: list[int], steps: int, solverOptions: dict) -> dict:
+    '''
+    Runs benchmarkPhases for the ladder of grid sizes and quadrature orders. Returns machine-readable results.
+    '''
+    results: dict = {
+        'createdAt': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'solverOptions': solverOptions,
+        'runs': []
+    }
+    print(f'Elements    n   ' + ''.join(f'{phase:<18}' for phase in benchmarkPhasesNames))
+    with tempfile.TemporaryDirectory() as workDir:
+        for size in sizes:
+            for n in orders:
+                run = benchmarkPhases(size, n, steps, workDir, solverOptions)
+                results['runs'].append(run)
+                print(f'{run["elements"]:<12}{n:<4}' + ''.join(f'{run["phases"][phase]["time"]:<18.4f}' for phase in benchmarkPhasesNames))
+    return results
+
+def compareResults(baseline: dict, current: dict, threshold: float) -> list[str]:
+    '''
+    Compares phase times of two benchmark results. Returns descriptions of phases slower than baseline by more than threshold (i.e. 0.2 = 20%).
+    '''
+    baselineRuns = {(run['elements'], run['n']): run for run in baseline['runs']}
+    regressions: list[str] = []
+    for run in current['runs']:
+        baselineRun = baselineRuns.get((run['elements'], run['n']))
+        if baselineRun is None:
+            continue
+        for phase, measurement in run['phases'].items():
+            if phase not in baselineRun['phases']:
+                continue
+            baselineTime = baselineRun['phases'][phase]['time']
+            if measurement['time'] > baselineTime*(1 + threshold):
+                regressions.append(f'{phase} (elements: {run["elements"]}, n: {run["n"]}): {baselineTime:.4f}s -> {measurement["time"]:.4f}s')
+    return regressions
+
+def benchmarkParallelAssembly(size: int, n: int, workers: int, chunkSize: int) -> dict:
+    '''
+    Measures wall time of local matrices calculation and global assembly done by ParallelAssembly with the given number of workers.
+    '''
+    grid = GridGenerator.createRectangular(size, size)
+    parallel = ParallelAssembly(workers, chunkSize)
+    start = perf_counter()
+    LocalMatricesCalculation.calculate(n, grid, parallel=parallel)
+    localMatricesTime = perf_counter() - start
+    start = perf_counter()
+    parallel.assemble(grid)
+    return {'workers': workers, 'localMatrices': localMatricesTime, 'globalAssembly': perf_counter() - start}
+
+def runParallelBenchmark(sizes: list[int], n: int, workersList: list[int], chunkSize: int) -> dict:
+    '''
+    Runs benchmarkParallelAssembly for every grid size and number of workers. Speedup is relative to the first number of workers.
+    '''
+    results: dict = {
+        'createdAt': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'n': n,
+        'chunkSize': chunkSize,
+        'runs': []
+    }
+    print(f'Elements    Workers  Local matrices [s]  Global assembly [s]  Speedup')
+    for size in sizes:
+        baseline = None
+        for workers in workersList:
+            run = {'elements': size*size, **benchmarkParallelAssembly(size, n, workers, chunkSize)}
+            total = run['localMatrices'] + run['globalAssembly']
+            baseline = baseline or total
+            run['speedup'] = baseline/total
+            results['runs'].append(run)
+            print(f'{run["elements"]:<12}{workers:<9}{run["localMatrices"]:<20.4f}{run["globalAssembly"]:<21.4f}{run["speedup"]:.2f}')
+    return results
+
+def run() -> None:
+    '''
+    Runs the benchmark from the command line.
+    '''
+    parser = argparse.ArgumentParser(description='Phase-level scaling benchmark of the simulation pipeline.')
+    parser.add_argument('--mode', choices=('phases', 'local-matrices', 'parallel'), default='phases')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 50, 100, 200], help='grids are size x size elements')
+    parser.add_argument('--orders', type=int, nargs='+', default=[2, 3, 4, 5], help='numbers of integration points')
+    parser.add_argument('--steps', type=int, default=10, help='number of solved time steps')
+    parser.add_argument('--solver', choices=SystemOfEquations.solvers, default='direct')
+    parser.add_argument('--dense', action='store_true', help='use dense global matrices')
+    parser.add_argument('--output', help='path of the JSON file with results')
+    parser.add_argument('--compare', help='path of the JSON file with baseline results')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown reported as regression')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of worker processes (parallel mode)')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='number of elements in a task (parallel mode)')
+    args = parser.parse_args()
+
+    if args.mode == 'local-matrices':
+        runLocalMatricesComparison(args.sizes)
+        return
+    if args.mode == 'parallel':
+        results = runParallelBenchmark(args.sizes, args.orders[0], args.workers, args.chunk_size)
+        if args.output:
+            with open(args.output, mode='w', encoding='utf-8') as file:
+                json.dump(results, file, indent=2)
+            print(f'Results saved in {args.output}')
+        return
+    results = runPhaseBenchmark(args.sizes, args.orders, args.steps, {'sparse': not args.dense, 'solver': args.solver})
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+        print(f'Results saved in {args.output}')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            regressions = compareResults(json.load(file), results, args.threshold)
+        for regression in regressions:
+            print(f'Regression: {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regressions found')
+
+if __name__ == '__main__':
+    run()
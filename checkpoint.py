@@ -0,0 +1,126 @@
+from common import *
+from grid import Grid
+from system_of_equations import SystemOfEquations
+from time import perf_counter
+import json
+import numpy as np
+
+# version of the checkpoint format, checkpoints of other versions cannot be restored
+checkpointVersion: int = 1
+
+class Checkpoint:
+    '''
+    State of a running simulation saved in uncompressed .npz file.
+
+    temperatures:   temperatures in nodes after the last solved step, (nodes, cases)
+    time:           simulation time of the last solved step
+    step:           current step size (changes in adaptive runs)
+    tau0:           fixed step loop counter of simulateSteps
+    stepsNumber:    number of solved steps
+    order:          number of integration points used for local matrices
+    solverOptions:  keyword arguments of SystemOfEquations of the run
+    meshHash:       hash of the grid (see Grid.getMeshHash), restart is refused for a different grid
+    '''
+    def __init__(self, temperatures: np.ndarray, time: float, step: float, tau0: float, stepsNumber: int, order: int,
+                 solverOptions: dict, meshHash: str):
+        self.temperatures: np.ndarray = temperatures
+        self.time: float = time
+        self.step: float = step
+        self.tau0: float = tau0
+        self.stepsNumber: int = stepsNumber
+        self.order: int = order
+        self.solverOptions: dict = solverOptions
+        self.meshHash: str = meshHash
+
+    @staticmethod
+    def create(soe: SystemOfEquations, tau0: float, stepsNumber: int, order: int, solverOptions: dict, meshHash: str) -> 'Checkpoint':
+        '''
+        Creates checkpoint of the current state of the system of equations.
+        '''
+        state = soe.getState()
+        return Checkpoint(state['temperatures'], state['time'], state['step'], tau0, stepsNumber, order, solverOptions, meshHash)
+
+    def save(self, filePath: str) -> None:
+        '''
+        Saves checkpoint. File is written under temporary name and renamed, so the previous checkpoint stays valid until
+        the new one is complete.
+        '''
+        directory = os.path.dirname(os.path.abspath(filePath))
+        os.makedirs(directory, exist_ok=True)
+        metadata = {
+            'version': checkpointVersion,
+            'time': self.time,
+            'step': self.step,
+            'tau0': self.tau0,
+            'stepsNumber': self.stepsNumber,
+            'order': self.order,
+            'solverOptions': {name: value.tolist() if isinstance(value, (np.ndarray, np.generic)) else value for name, value in self.solverOptions.items()},
+            'meshHash': self.meshHash
+        }
+        temporaryPath = f'{filePath}.{os.getpid()}.tmp'
+        with open(temporaryPath, 'wb') as f:
+            np.savez(f, metadata=np.array(json.dumps(metadata)), temperatures=self.temperatures)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporaryPath, filePath)
+
+    @staticmethod
+    def load(filePath: str) -> 'Checkpoint':
+        '''
+        Reads checkpoint saved by save().
+        '''
+        try:
+            with np.load(filePath) as data:
+                metadata: dict = json.loads(str(data['metadata']))
+                temperatures = data['temperatures']
+        except Exception as e:
+            raise FiniteElementMethodException(f'Error while reading checkpoint {filePath}. Error:\n{e}')
+        if metadata['version'] != checkpointVersion:
+            raise FiniteElementMethodException(f'Checkpoint {filePath} has version {metadata["version"]}, expected {checkpointVersion}.')
+        return Checkpoint(temperatures, metadata['time'], metadata['step'], metadata['tau0'], metadata['stepsNumber'],
+                          metadata['order'], metadata['solverOptions'], metadata['meshHash'])
+
+    def checkGrid(self, grid: Grid) -> None:
+        '''
+        Raises exception if the checkpoint was created for a different grid.
+        '''
+        if grid.getMeshHash() != self.meshHash:
+            raise FiniteElementMethodException('Checkpoint was created for a different grid.')
+
+class CheckpointWriter:
+    '''
+    Saves checkpoints of a running simulation every everySteps steps and/or every everySeconds seconds of wall time.
+
+    filePath:       path to the checkpoint file, the latest checkpoint replaces the previous one
+    order:          number of integration points used for local matrices (stored for restart)
+    everySteps:     checkpoint interval in solved steps, None to disable
+    everySeconds:   checkpoint interval in seconds of wall time, None to disable
+    saved:          number of saved checkpoints
+    '''
+    def __init__(self, filePath: str, order: int, everySteps: int = None, everySeconds: float = None):
+        if everySteps is not None and everySteps < 1:
+            raise FiniteElementMethodException('Checkpoint interval (everySteps) must be a positive integer.')
+        self.filePath: str = filePath
+        self.order: int = order
+        self.everySteps: int = everySteps
+        self.everySeconds: float = everySeconds
+        self.saved: int = 0
+        self._lastStepsNumber: int = 0
+        self._lastTime: float = perf_counter()
+        self._meshHash: str = None
+
+    def update(self, grid: Grid, soe: SystemOfEquations, tau0: float, stepsNumber: int, solverOptions: dict, force: bool = False) -> bool:
+        '''
+        Saves checkpoint if any interval has passed since the last one (or if force is True). Returns True if it was saved.
+        '''
+        due = force or (self.everySteps is not None and stepsNumber - self._lastStepsNumber >= self.everySteps) \
+            or (self.everySeconds is not None and perf_counter() - self._lastTime >= self.everySeconds)
+        if not due:
+            return False
+        if self._meshHash is None:
+            self._meshHash = grid.getMeshHash()
+        Checkpoint.create(soe, tau0, stepsNumber, self.order, solverOptions, self._meshHash).save(self.filePath)
+        self.saved += 1
+        self._lastStepsNumber = stepsNumber
+        self._lastTime = perf_counter()
+        return True
@@ -1,20 +1,20 @@
 import os
-from jinja2 import Environment, FileSystemLoader, Template
 
 scriptPath: str = os.getcwd()
 gridsPath: str = os.path.join(scriptPath, 'Data', 'Grids')
 outputPath: str = os.path.join(scriptPath, 'Data', 'Output')
 templatesPath: str = os.path.join(scriptPath, 'Data', 'Templates')
+cachePath: str = os.path.join(scriptPath, 'Data', 'Cache')
 
 class FiniteElementMethodException(Exception):
     pass
 
-def createOrClearDirectory(inputFilename: str) -> str:
+def createOrClearDirectory(inputFilename: str, outputDir: str = outputPath) -> str:
     try:
-        os.mkdir(outputPath)
+        os.makedirs(outputDir)
     except FileExistsError:
         pass
-    dirPath = os.path.join(outputPath, os.path.basename(inputFilename).split('.')[0])
+    dirPath = os.path.join(outputDir, os.path.basename(inputFilename).split('.')[0])
 
     try:
         os.mkdir(dirPath)
@@ -31,12 +31,14 @@ def createOrClearDirectory(inputFilename: str) -> str:
     finally:
         return dirPath
     
-def initializeJinjaEnvironment(templateFile: str) -> Template:
+def initializeJinjaEnvironment(templateFile: str) -> 'Template':
+    # Jinja is imported only when a template is used
+    from jinja2 import Environment, FileSystemLoader
     environment = Environment(loader=FileSystemLoader(templatesPath))
     template = environment.get_template(templateFile)
     return template
 
-def generateFile(data: dict, template: Template, destinationDir: str, outputFileName: str) -> None:
+def generateFile(data: dict, template: 'Template', destinationDir: str, outputFileName: str) -> None:
     outputFilepath = os.path.join(destinationDir, outputFileName)
     content = template.render(data)
     with open(outputFilepath, mode='w', encoding='utf-8') as file:
@@ -1,6 +1,14 @@
 from common import *
 from universal_element import *
+from collections.abc import Sequence
+import hashlib
+import json
+import mmap
 import numpy as np
+import re
+
+# version of the grid file parser and cache file naming, cached grids created by other versions are ignored
+gridParserVersion: int = 2
 
 class GlobalData:
     '''
@@ -18,6 +26,23 @@ class GlobalData:
         self.nodesNumber: int = globalDataDict['Nodesnumber']
         self.elementsNumber: int = globalDataDict['Elementsnumber']
 
+    def toDict(self) -> dict:
+        '''
+        Returns global data in the format accepted by the constructor.
+        '''
+        return {
+            'SimulationTime': self.simulationTime,
+            'SimulationStepTime': self.simulationStepTime,
+            'Conductivity': self.conductivity,
+            'Alfa': self.alfa,
+            'Tot': self.tot,
+            'InitialTemp': self.initialTemp,
+            'Density': self.density,
+            'SpecificHeat': self.specificHeat,
+            'Nodesnumber': self.nodesNumber,
+            'Elementsnumber': self.elementsNumber
+        }
+
     def print(self) -> None:
         print(f'Simulation time: \t{self.simulationTime}')
         print(f'Simulation step time: \t{self.simulationStepTime}')
@@ -32,25 +57,57 @@ class GlobalData:
 
 class Node:
     '''
-    Stores information about a single node of the grid.
+    Lightweight view of a single node stored in the arrays of the grid.
 
     id:      Node's ID
     x:       x coord
     y:       y coord
     BC:      border condition (0 or 1)
     '''
-    def __init__(self, id: int, x: float, y: float):
-        self.id: int = id
-        self.x: float = x
-        self.y: float = y
-        self.BC: float = 0
+    __slots__ = ('grid', 'index')
+
+    def __init__(self, grid: 'Grid', index: int):
+        self.grid: Grid = grid
+        self.index: int = index
+
+    @property
+    def id(self) -> int:
+        return self.index + 1
+
+    @property
+    def x(self) -> float:
+        return float(self.grid.nodeCoords[self.index, 0])
+
+    @x.setter
+    def x(self, value: float) -> None:
+        self.grid.nodeCoords[self.index, 0] = value
+        self.grid._boundaryEdges = None
+
+    @property
+    def y(self) -> float:
+        return float(self.grid.nodeCoords[self.index, 1])
+
+    @y.setter
+    def y(self, value: float) -> None:
+        self.grid.nodeCoords[self.index, 1] = value
+        self.grid._boundaryEdges = None
+
+    @property
+    def BC(self) -> int:
+        return int(self.grid.bcMask[self.index])
+
+    @BC.setter
+    def BC(self, value: int) -> None:
+        self.grid.bcMask[self.index] = bool(value)
+        self.grid._boundaryEdges = None
 
     def print(self) -> None:
         print(f'Node {self.id}: \t({self.x}, {self.y})')
 
 class Element:
     '''
-    Stores information about a single 4-node element of the grid.
+    Lightweight view of a single 4-node element stored in the arrays of the grid.
+    Matrices are views of the stacked arrays of the grid, assigning to them writes into the grid.
 
     id:         Element's ID
     IDs:        IDs od nodes belonging to the element
@@ -59,114 +116,405 @@ class Element:
     P:          P vector for the element (4X1)
     C:          C matrix for the element (4x4)
     '''
-    def __init__(self, id: int, nodeIds: list[int]):
-        self.id: int = id
-        self.nodeIds: list[int] = nodeIds
-        self.H: np.ndarray = np.zeros((4, 4))
-        self.Hbc: np.ndarray = np.zeros((4, 4))
-        self.P: np.ndarray = np.zeros((4, 1))
-        self.C: np.ndarray = np.zeros((4, 4))
+    __slots__ = ('grid', 'index')
+
+    def __init__(self, grid: 'Grid', index: int):
+        self.grid: Grid = grid
+        self.index: int = index
+
+    @property
+    def id(self) -> int:
+        return int(self.grid.elementIds[self.index])
+
+    @property
+    def nodeIds(self) -> list[int]:
+        return (self.grid.connectivity[self.index] + 1).tolist()
+
+    @property
+    def H(self) -> np.ndarray:
+        return self.grid.H[self.index]
+
+    @H.setter
+    def H(self, value: np.ndarray) -> None:
+        self.grid.H[self.index] = value
+
+    @property
+    def Hbc(self) -> np.ndarray:
+        return self.grid.Hbc[self.index]
+
+    @Hbc.setter
+    def Hbc(self, value: np.ndarray) -> None:
+        self.grid.Hbc[self.index] = value
+
+    @property
+    def C(self) -> np.ndarray:
+        return self.grid.C[self.index]
+
+    @C.setter
+    def C(self, value: np.ndarray) -> None:
+        self.grid.C[self.index] = value
+
+    @property
+    def P(self) -> np.ndarray:
+        return self.grid.P[self.index, :, None]
+
+    @P.setter
+    def P(self, value: np.ndarray) -> None:
+        self.grid.P[self.index] = np.ravel(value)
 
     def print(self) -> None:
         print(f'Element {self.id}: \t{self.nodeIds}')
 
+class BoundaryEdges:
+    '''
+    Index of element edges with border condition on both nodes.
+
+    elementIndices:     zero-based index of the element of every edge
+    localEdges:         local edge number, edge i spans local nodes i and (i+1)%4 (down, right, up, left)
+    lengths:            lengths of edges
+    '''
+    def __init__(self, nodeCoords: np.ndarray, connectivity: np.ndarray, bcMask: np.ndarray):
+        nextNodes = np.roll(connectivity, -1, axis=1)
+        self.elementIndices, self.localEdges = np.nonzero(bcMask[connectivity] & bcMask[nextNodes])
+        edgeNodes = connectivity[self.elementIndices, self.localEdges]
+        edgeNextNodes = nextNodes[self.elementIndices, self.localEdges]
+        self.lengths: np.ndarray = np.linalg.norm(nodeCoords[edgeNextNodes] - nodeCoords[edgeNodes], axis=1)
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+class GridItems(Sequence):
+    '''
+    Read-only sequence of Node or Element views, created on access.
+    '''
+    __slots__ = ('grid', 'itemClass', 'length')
+
+    def __init__(self, grid: 'Grid', itemClass: type, length: int):
+        self.grid: Grid = grid
+        self.itemClass: type = itemClass
+        self.length: int = length
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.itemClass(self.grid, i) for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError(f'{self.itemClass.__name__} index out of range')
+        return self.itemClass(self.grid, index)
+
 class Grid:
     '''
-    Stores information allowing to recreate the grid.
+    Stores information allowing to recreate the grid as arrays.
 
     globalData:     i.e. simulation time, conductivity, initial temperature, density etc.
-    nodes:          list of nodes in the grid
-    elements:       list of elements in the grid
-    BC:             list of nodes with border condition
+    nodeCoords:     coords of nodes (N, 2)
+    connectivity:   zero-based indices of nodes of every element (E, 4)
+    bcMask:         True for nodes with border condition (N,)
+    elementIds:     IDs of elements (E,)
+    H, C, Hbc:      stacked local matrices of elements (E, 4, 4), allocated on first access
+    P:              stacked local P vectors of elements (E, 4), allocated on first access
+    nodes:          sequence of Node views
+    elements:       sequence of Element views
+
+    cacheStats:     number of cache hits and misses of createFromFile
     '''
-    def __init__(self, globalData: GlobalData = None, elements: list[Element] = None, nodes: list[Node] = None):
+    cacheStats: dict = {'hits': 0, 'misses': 0}
+
+    def __init__(self, globalData: GlobalData, nodeCoords: np.ndarray, connectivity: np.ndarray, bcMask: np.ndarray, elementIds: np.ndarray = None):
         self.globalData: GlobalData = globalData
-        self.nodes: list[Node] = nodes
-        self.elements: list[Element] = elements
-        
+        self.nodeCoords: np.ndarray = np.ascontiguousarray(nodeCoords, dtype=float)
+        self.connectivity: np.ndarray = np.ascontiguousarray(connectivity, dtype=np.int64)
+        self.bcMask: np.ndarray = np.ascontiguousarray(bcMask, dtype=bool)
+        self.elementIds: np.ndarray = np.arange(1, len(self.connectivity) + 1) if elementIds is None else np.asarray(elementIds, dtype=np.int64)
+        self._H: np.ndarray = None
+        self._C: np.ndarray = None
+        self._Hbc: np.ndarray = None
+        self._P: np.ndarray = None
+        self._boundaryEdges: BoundaryEdges = None
+
+    @property
+    def nodes(self) -> GridItems:
+        return GridItems(self, Node, len(self.nodeCoords))
+
+    @property
+    def elements(self) -> GridItems:
+        return GridItems(self, Element, len(self.connectivity))
+
+    @property
+    def H(self) -> np.ndarray:
+        if self._H is None:
+            self._H = np.zeros((len(self.connectivity), 4, 4))
+        return self._H
+
+    @H.setter
+    def H(self, value: np.ndarray) -> None:
+        self._H = np.asarray(value, dtype=float)
+
+    @property
+    def C(self) -> np.ndarray:
+        if self._C is None:
+            self._C = np.zeros((len(self.connectivity), 4, 4))
+        return self._C
+
+    @C.setter
+    def C(self, value: np.ndarray) -> None:
+        self._C = np.asarray(value, dtype=float)
+
+    @property
+    def Hbc(self) -> np.ndarray:
+        if self._Hbc is None:
+            self._Hbc = np.zeros((len(self.connectivity), 4, 4))
+        return self._Hbc
+
+    @Hbc.setter
+    def Hbc(self, value: np.ndarray) -> None:
+        self._Hbc = np.asarray(value, dtype=float)
+
+    @property
+    def P(self) -> np.ndarray:
+        if self._P is None:
+            self._P = np.zeros((len(self.connectivity), 4))
+        return self._P
+
+    @P.setter
+    def P(self, value: np.ndarray) -> None:
+        self._P = np.asarray(value, dtype=float).reshape(-1, 4)
+
     @classmethod
-    def createFromFile(cls, inputFilePath: str):
+    def createFromFile(cls, inputFilePath: str, useCache: bool = False, cacheDir: str = cachePath):
+        '''
+        Creates a grid from input file.
+
+        useCache:   if True, parsed grid is stored in cacheDir as .npz file keyed by absolute path and content hash of the input file
+                    and parser version,
+                    later calls read the cached arrays instead of parsing the file
+        '''
         try:
             print(os.path.basename(inputFilePath))
-            f = open(inputFilePath, 'r')
-            fileContent: str = f.readlines()
-            globalData: GlobalData = cls._readGlobalData(fileContent)
-            nodes: list[Node] = cls._readNodes(fileContent, globalData.nodesNumber)
-            elements: list[Element] = cls._readElements(fileContent, globalData.nodesNumber, globalData.elementsNumber)
-            BC: list[Node] = cls._readBC(fileContent, globalData.nodesNumber, globalData.elementsNumber)
-            cls._addBcToNode(nodes, BC)
-            f.close()
-            return cls(globalData, elements, nodes)
+            if not useCache:
+                return cls(*cls._readFile(inputFilePath))
+            cacheFilePath = cls._getCacheFilePath(inputFilePath, cacheDir)
+            if os.path.isfile(cacheFilePath):
+                cls.cacheStats['hits'] += 1
+                print(f'Grid cache hit: {cacheFilePath}')
+                return cls(*cls._readCache(cacheFilePath))
+            cls.cacheStats['misses'] += 1
+            print(f'Grid cache miss: {cacheFilePath}')
+            gridArrays = cls._readFile(inputFilePath)
+            cls._writeCache(cacheFilePath, *gridArrays)
+            return cls(*gridArrays)
         except Exception as e:
             raise FiniteElementMethodException(f'Error while creating a Grid object. Check if your input file format is correct. Error:\n{e}')
 
     @staticmethod
-    def _readGlobalData(input: str) -> GlobalData:
+    def _readFile(inputFilePath: str) -> tuple:
         '''
-        Reads global data from input file.
+        Reads grid file through memory map. Locates *Node, *Element and *BC sections and parses each of them into numpy array at once.
+        Returns global data, (N, 2) node coords, (E, 4) zero-based connectivity, (N,) border condition mask and (E,) element IDs.
         '''
-        globalDataDict = {}
-        for i in range (0, 8):
-            line = input[i]
-            line = line.split(' ')
-            for i in range (0, 2):
-                line[i] = line[i].strip()
-            globalDataDict[line[0]] = int(line[1])
-        for i in range (8, 10):
-            line = input[i]
-            line = line.split(' ')
-            for i in range (0, 3):
-                line[i] = line[i].strip()
-            line[0] = line[0] + line[1]
-            globalDataDict[line[0]] = int(line[2])
-        return GlobalData(globalDataDict)
+        with open(inputFilePath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+            nodeStart = Grid._findSection(content, b'*Node', 0)
+            elementStart = Grid._findSection(content, b'*Element', nodeStart)
+            bcStart = Grid._findSection(content, b'*BC', elementStart)
+            globalData = Grid._readGlobalData(content[:nodeStart])
+            nodes = Grid._parseBlock(content[Grid._nextLine(content, nodeStart):elementStart], float, 3)
+            elements = Grid._parseBlock(content[Grid._nextLine(content, elementStart):bcStart], np.int64, 5)
+            BC = Grid._parseBlock(content[Grid._nextLine(content, bcStart):], np.int64, 1).ravel()
+
+        if len(nodes) != globalData.nodesNumber or len(elements) != globalData.elementsNumber:
+            raise FiniteElementMethodException(f'Expected {globalData.nodesNumber} nodes and {globalData.elementsNumber} elements, found {len(nodes)} and {len(elements)}.')
+        nodeCoords = np.empty((len(nodes), 2))
+        nodeCoords[nodes[:, 0].astype(np.int64) - 1] = nodes[:, 1:]
+        bcMask = np.zeros(len(nodes), dtype=bool)
+        bcMask[BC - 1] = True
+        return globalData, nodeCoords, elements[:, 1:] - 1, bcMask, elements[:, 0]
+
+    @staticmethod
+    def _getCacheFilePath(inputFilePath: str, cacheDir: str) -> str:
+        '''
+        Returns path of the cache file: <input file name>-<absolute path hash prefix>-<content hash prefix>-v<parser version>.npz.
+        Path hash keeps caches of different files with the same name apart.
+        '''
+        name = os.path.basename(inputFilePath).split('.')[0]
+        pathHash = hashlib.sha256(os.path.abspath(inputFilePath).encode('utf-8')).hexdigest()[:8]
+        return os.path.join(cacheDir, f'{name}-{pathHash}-{Grid._hashFile(inputFilePath)[:20]}-v{gridParserVersion}.npz')
+
+    @staticmethod
+    def _hashFile(inputFilePath: str) -> str:
+        '''
+        Returns SHA-256 hash of the file content.
+        '''
+        fileHash = hashlib.sha256()
+        with open(inputFilePath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                fileHash.update(chunk)
+        return fileHash.hexdigest()
+
+    @staticmethod
+    def _writeCache(cacheFilePath: str, globalData: GlobalData, nodeCoords: np.ndarray, connectivity: np.ndarray, bcMask: np.ndarray, elementIds: np.ndarray) -> None:
+        '''
+        Saves parsed grid arrays to uncompressed .npz file. File is written under temporary name and renamed, so it is never read half-written.
+        '''
+        os.makedirs(os.path.dirname(cacheFilePath), exist_ok=True)
+        temporaryPath = f'{cacheFilePath}.{os.getpid()}.tmp'
+        with open(temporaryPath, 'wb') as f:
+            np.savez(f, globalData=np.array(json.dumps(globalData.toDict())), nodeCoords=nodeCoords,
+                     connectivity=connectivity, bcMask=bcMask, elementIds=elementIds)
+        os.replace(temporaryPath, cacheFilePath)
 
     @staticmethod
-    def _readNodes(input: str, nodesNumber: int) -> list[Node]:
+    def _readCache(cacheFilePath: str) -> tuple:
         '''
-        Reads nodes from input file.
+        Reads grid arrays saved by _writeCache.
         '''
-        nodeList = []
-        for i in range (11, 11 + nodesNumber):
-            line = input[i].split(', ')
-            nodeList.append(Node(int(line[0]), float(line[1]), float(line[2])))
-        return nodeList
+        with np.load(cacheFilePath) as data:
+            globalData = GlobalData(json.loads(str(data['globalData'])))
+            return globalData, data['nodeCoords'], data['connectivity'], data['bcMask'], data['elementIds']
 
     @staticmethod
-    def _readElements(input: str, nodesNumber: int, elementsNumber: int) -> list[Element]:
-        '''
-        Reads elements data from input file.
-        '''
-        elements = []
-        nodeIds = []
-        for i in range (11 + nodesNumber + 1, 11 + nodesNumber + 1 + elementsNumber):
-            line = input[i].split(', ')
-            for i in range (1, len(line)):
-                nodeIds.append(int(line[i]))
-            elements.append(Element(int(line[0]), nodeIds))
-            nodeIds = []
-        return elements
-    
+    def purgeCache(cacheDir: str = cachePath, inputFilePath: str = None) -> int:
+        '''
+        Removes cached grids created by other parser versions. If inputFilePath is given, also removes cached grids
+        of the same file (same absolute path) that do not match its current content. Returns number of removed files.
+        Local matrices cached in cacheDir by older versions (localMatrices-<hash>.npz, now kept next to checkpoints) are removed too,
+        other files are kept.
+        '''
+        if not os.path.isdir(cacheDir):
+            return 0
+        currentFilename = None if inputFilePath is None else os.path.basename(Grid._getCacheFilePath(inputFilePath, cacheDir))
+        # <input file name>-<path hash> part shared by all cached versions of the input file
+        currentPrefix = None if currentFilename is None else currentFilename.rsplit('-', 2)[0]
+        removed = 0
+        for filename in os.listdir(cacheDir):
+            match = re.fullmatch(r'(.+)-[0-9a-f]{20}-v(\d+)\.npz', filename)
+            if match is None:
+                stale = re.fullmatch(r'localMatrices-[0-9a-f]{20}\.npz', filename) is not None
+            else:
+                stale = match.group(2) != str(gridParserVersion)
+            if match is not None and currentPrefix is not None and match.group(1) == currentPrefix and filename != currentFilename:
+                stale = True
+            if stale:
+                os.unlink(os.path.join(cacheDir, filename))
+                removed += 1
+        print(f'Removed {removed} stale grid cache files from {cacheDir}')
+        return removed
+
     @staticmethod
-    def _readBC(input: str, nodesNumber: int, elementsNumber: int) -> list[int]:
+    def _findSection(content: mmap.mmap, marker: bytes, start: int) -> int:
         '''
-        Reads nodes with border condition from input file.
+        Returns position of the section marker in the file.
         '''
-        nodeIDs = []
-        line = input[11 + nodesNumber + 1 + elementsNumber + 1]
-        line = line.split(', ')
-        for i in range(0, len(line)):
-            nodeIDs.append(int(line[i]))
-        return nodeIDs
-    
+        position = content.find(marker, start)
+        if position == -1:
+            raise FiniteElementMethodException(f'Section {marker.decode()} not found.')
+        return position
+
     @staticmethod
-    def _addBcToNode(nodes: list[Node], BC: list[int]) -> None:
+    def _nextLine(content: mmap.mmap, position: int) -> int:
+        '''
+        Returns position of the beginning of the line following the given position.
+        '''
+        end = content.find(b'\n', position)
+        return len(content) if end == -1 else end + 1
+
+    @staticmethod
+    def _parseBlock(block: bytes, dtype: type, columns: int) -> np.ndarray:
+        '''
+        Parses comma separated numeric block into (rows, columns) array.
+        '''
+        values = np.fromstring(block.replace(b',', b' '), dtype=dtype, sep=' ')
+        return values.reshape(-1, columns)
+
+    @staticmethod
+    def _readGlobalData(header: bytes) -> GlobalData:
+        '''
+        Reads global data from the header of input file, i.e. "SimulationTime 500" or "Nodes number 16".
         '''
-        Adds border condition to node.
+        globalDataDict = {}
+        for line in header.decode().splitlines():
+            words = line.split()
+            if len(words) < 2:
+                continue
+            try:
+                globalDataDict[''.join(words[:-1])] = int(words[-1])
+            except ValueError:
+                globalDataDict[''.join(words[:-1])] = float(words[-1])
+        return GlobalData(globalDataDict)
+
+    def writeToFile(self, outputFilePath: str) -> None:
+        '''
+        Writes the grid in the input file format (see Data/example_grid.txt).
+        '''
+        glData = self.globalData
+        with open(outputFilePath, mode='w', encoding='utf-8') as file:
+            file.write(f'SimulationTime {glData.simulationTime}\n')
+            file.write(f'SimulationStepTime {glData.simulationStepTime}\n')
+            file.write(f'Conductivity {glData.conductivity}\n')
+            file.write(f'Alfa {glData.alfa}\n')
+            file.write(f'Tot {glData.tot}\n')
+            file.write(f'InitialTemp {glData.initialTemp}\n')
+            file.write(f'Density {glData.density}\n')
+            file.write(f'SpecificHeat {glData.specificHeat}\n')
+            file.write(f'Nodes number {len(self.nodeCoords)}\n')
+            file.write(f'Elements number {len(self.connectivity)}\n')
+            file.write('*Node\n')
+            np.savetxt(file, np.column_stack((np.arange(1, len(self.nodeCoords) + 1), self.nodeCoords)), fmt='%7d, %.12g, %.12g')
+            file.write('*Element, type=DC2D4\n')
+            np.savetxt(file, np.column_stack((self.elementIds, self.connectivity + 1)), fmt='%d', delimiter=', ')
+            file.write('*BC\n')
+            file.write(', '.join(map(str, (np.flatnonzero(self.bcMask) + 1).tolist())) + '\n')
+
+    def getNodeCoords(self) -> np.ndarray:
+        '''
+        Returns coords of all nodes as an (N, 2) array.
+        '''
+        return self.nodeCoords
+
+    def getConnectivity(self) -> np.ndarray:
+        '''
+        Returns zero-based node indices of all elements as an (E, 4) array.
+        '''
+        return self.connectivity
+
+    def getBcMask(self) -> np.ndarray:
+        '''
+        Returns (N,) boolean array, True for nodes with border condition.
         '''
-        for nodeID in BC:
-            nodes[nodeID - 1].BC = 1
-    
+        return self.bcMask
+
+    def getElementCoords(self) -> np.ndarray:
+        '''
+        Returns coords of nodes of every element as an (E, 4, 2) array.
+        '''
+        return self.nodeCoords[self.connectivity]
+
+    def getBoundaryEdges(self) -> BoundaryEdges:
+        '''
+        Returns index of edges with border condition, created on first call and reused afterwards.
+        '''
+        if self._boundaryEdges is None:
+            self._boundaryEdges = BoundaryEdges(self.nodeCoords, self.connectivity, self.bcMask)
+        return self._boundaryEdges
+
+    def getMeshHash(self) -> str:
+        '''
+        Returns SHA-256 hash of node coords, connectivity and border conditions (geometry of the grid, without global data).
+        '''
+        meshHash = hashlib.sha256()
+        for array in (self.nodeCoords.astype('<f8'), self.connectivity.astype('<i8'), self.bcMask.astype('u1')):
+            meshHash.update(np.ascontiguousarray(array).tobytes())
+        return meshHash.hexdigest()
+
+    def getLocalMatrices(self) -> tuple[np.ndarray]:
+        '''
+        Returns local H, C, Hbc matrices (E, 4, 4) and P vectors (E, 4) of all elements stacked into arrays.
+        '''
+        return self.H, self.C, self.Hbc, self.P
+
     def print(self) -> None:
         self.globalData.print()
         print('\nNodes:')
@@ -175,4 +523,4 @@ class Grid:
         print('\nElements:')
         for element in self.elements:
             element.print()
-        print(f'\nBC:\n{self.BC}\n')
\ No newline at end of file
+        print(f'\nBC:\n{(np.flatnonzero(self.bcMask) + 1).tolist()}\n')
@@ -0,0 +1,65 @@
+from common import *
+from grid import Grid, GlobalData
+import numpy as np
+
+class GridGenerator:
+    '''
+    Abstract class for generating structured grids directly in memory.
+    '''
+    defaultGlobalData: dict = {
+        'SimulationTime': 500,
+        'SimulationStepTime': 50,
+        'Conductivity': 25,
+        'Alfa': 300,
+        'Tot': 1200,
+        'InitialTemp': 100,
+        'Density': 7800,
+        'SpecificHeat': 700
+    }
+    edges: tuple[str] = ('down', 'right', 'up', 'left')
+
+    def __init__(self):
+        raise FiniteElementMethodException('GridGenerator is an abstract class, you cannot create an instance of this class.')
+
+    @staticmethod
+    def createRectangular(nx: int, ny: int, width: float = 0.1, height: float = 0.1, globalDataDict: dict = None,
+                          bcEdges: tuple[str] = edges, origin: tuple[float] = (0.0, 0.0), outputFilePath: str = None) -> Grid:
+        '''
+        Creates a rectangular grid of nx x ny 4-node elements.
+
+        globalDataDict:     simulation time, conductivity etc. (see GlobalData), missing values are taken from defaultGlobalData
+        bcEdges:            edges of the rectangle with border condition, any of 'down', 'right', 'up', 'left'
+        origin:             coords of the lower left corner
+        outputFilePath:     if given, the grid is also written to this file in the input file format
+        '''
+        if nx < 1 or ny < 1:
+            raise FiniteElementMethodException('Number of elements in each direction must be a positive integer.')
+        unknownEdges = set(bcEdges) - set(GridGenerator.edges)
+        if unknownEdges:
+            raise FiniteElementMethodException(f'Unknown edges {", ".join(sorted(unknownEdges))}, available edges: {", ".join(GridGenerator.edges)}.')
+
+        globalDataDict = {**GridGenerator.defaultGlobalData, **(globalDataDict or {})}
+        globalDataDict['Nodesnumber'] = (nx + 1)*(ny + 1)
+        globalDataDict['Elementsnumber'] = nx*ny
+
+        # nodes are numbered row by row from the lower left corner
+        i, j = np.meshgrid(np.arange(nx + 1), np.arange(ny + 1))
+        nodeCoords = np.column_stack((origin[0] + width*i.ravel()/nx, origin[1] + height*j.ravel()/ny))
+        bcMask = np.zeros((ny + 1, nx + 1), dtype=bool)
+        if 'down' in bcEdges:
+            bcMask[0, :] = True
+        if 'right' in bcEdges:
+            bcMask[:, -1] = True
+        if 'up' in bcEdges:
+            bcMask[-1, :] = True
+        if 'left' in bcEdges:
+            bcMask[:, 0] = True
+
+        # counterclockwise node order, starting from the lower left corner of the element
+        first = (np.arange(ny)[:, None]*(nx + 1) + np.arange(nx)).ravel()
+        connectivity = np.column_stack((first, first + 1, first + nx + 2, first + nx + 1))
+
+        grid = Grid(GlobalData(globalDataDict), nodeCoords, connectivity, bcMask.ravel())
+        if outputFilePath is not None:
+            grid.writeToFile(outputFilePath)
+        return grid
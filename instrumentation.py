@@ -0,0 +1,167 @@
+from common import *
+from collections.abc import Callable
+from contextlib import contextmanager
+from time import perf_counter, process_time
+import cProfile
+import io
+import json
+import pstats
+import tracemalloc
+import numpy as np
+
+class Instrumentation:
+    '''
+    Collects timings and counters of the simulation pipeline and notifies subscribers about its events.
+
+    phases:         dict of phase name -> {'wallTime', 'cpuTime', 'calls'}, times are summed over all calls
+    counters:       dict of counter name -> value, i.e. number of allocated global matrices
+    stepTimes:      wall time of every solved step
+    profile:        if True, cProfile statistics are captured between start() and stop()
+    traceMemory:    if True, tracemalloc statistics are captured between start() and stop()
+
+    Subscribers are called with event dicts:
+    {'event': 'phase', 'name', 'wallTime', 'cpuTime'} after every phase,
+    {'event': 'step', 'step', 'time', 'solveTime', 'minTemp', 'maxTemp', 'iterations'} after every solved step.
+    '''
+    def __init__(self, profile: bool = False, traceMemory: bool = False):
+        self.phases: dict = {}
+        self.counters: dict = {}
+        self.stepTimes: list[float] = []
+        self.profile: bool = profile
+        self.traceMemory: bool = traceMemory
+        self._subscribers: list[Callable[[dict], None]] = []
+        self._profiler: cProfile.Profile = None
+        self._memorySnapshot: tracemalloc.Snapshot = None
+        self._peakMemory: int = None
+        self._startWallTime: float = None
+        self._totalWallTime: float = None
+
+    def subscribe(self, callback: Callable[[dict], None]) -> None:
+        '''
+        Registers callback called with every phase and step event.
+        '''
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[dict], None]) -> None:
+        self._subscribers.remove(callback)
+
+    def _emit(self, event: dict) -> None:
+        for callback in self._subscribers:
+            callback(event)
+
+    def start(self) -> None:
+        '''
+        Starts measuring total time and, if enabled, profiling and memory tracing.
+        '''
+        self._startWallTime = perf_counter()
+        if self.traceMemory:
+            tracemalloc.start()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        '''
+        Stops measuring started by start().
+        '''
+        if self._profiler is not None:
+            self._profiler.disable()
+        if self.traceMemory and tracemalloc.is_tracing():
+            self._peakMemory = tracemalloc.get_traced_memory()[1]
+            self._memorySnapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+        if self._startWallTime is not None:
+            self._totalWallTime = perf_counter() - self._startWallTime
+
+    @contextmanager
+    def phase(self, name: str):
+        '''
+        Measures wall and CPU time of the code block, times of phases with the same name are summed.
+        '''
+        wallStart = perf_counter()
+        cpuStart = process_time()
+        try:
+            yield
+        finally:
+            wallTime = perf_counter() - wallStart
+            cpuTime = process_time() - cpuStart
+            phase = self.phases.setdefault(name, {'wallTime': 0.0, 'cpuTime': 0.0, 'calls': 0})
+            phase['wallTime'] += wallTime
+            phase['cpuTime'] += cpuTime
+            phase['calls'] += 1
+            self._emit({'event': 'phase', 'name': name, 'wallTime': wallTime, 'cpuTime': cpuTime})
+
+    def count(self, name: str, value: int = 1) -> None:
+        '''
+        Increases counter by value.
+        '''
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def recordStep(self, time: float, solveTime: float, temperatures: np.ndarray, iterations: int = None) -> None:
+        '''
+        Records a solved time step and notifies subscribers.
+        '''
+        self.stepTimes.append(solveTime)
+        self._emit({
+            'event': 'step',
+            'step': len(self.stepTimes),
+            'time': time,
+            'solveTime': solveTime,
+            'minTemp': float(temperatures.min()),
+            'maxTemp': float(temperatures.max()),
+            'iterations': iterations
+        })
+
+    def stepTimeHistogram(self, bins: int = 10) -> dict:
+        '''
+        Returns histogram of step solve times: bin edges in seconds and counts.
+        '''
+        if not self.stepTimes:
+            return {'binEdges': [], 'counts': []}
+        counts, binEdges = np.histogram(self.stepTimes, bins=bins)
+        return {'binEdges': binEdges.tolist(), 'counts': counts.tolist()}
+
+    def report(self, profileEntries: int = 20, memoryEntries: int = 10) -> dict:
+        '''
+        Returns structured summary of the run.
+        '''
+        stepTimes = np.array(self.stepTimes)
+        report: dict = {
+            'totalWallTime': self._totalWallTime,
+            'phases': self.phases,
+            'counters': self.counters,
+            'steps': {
+                'count': len(stepTimes),
+                'totalSolveTime': float(stepTimes.sum()),
+                'meanSolveTime': float(stepTimes.mean()) if len(stepTimes) else None,
+                'maxSolveTime': float(stepTimes.max()) if len(stepTimes) else None,
+                'histogram': self.stepTimeHistogram()
+            }
+        }
+        if self._profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(self._profiler, stream=stream).sort_stats('cumulative').print_stats(profileEntries)
+            report['profile'] = stream.getvalue()
+        if self._memorySnapshot is not None:
+            report['memory'] = {
+                'peak': self._peakMemory,
+                'top': [str(statistic) for statistic in self._memorySnapshot.statistics('lineno')[:memoryEntries]]
+            }
+        return report
+
+    def printReport(self) -> None:
+        '''
+        Prints report as JSON (profile is printed as text after it).
+        '''
+        report = self.report()
+        profile = report.pop('profile', None)
+        print(json.dumps(report, indent=2))
+        if profile is not None:
+            print(profile)
+
+    def saveReport(self, outputFilePath: str) -> None:
+        '''
+        Saves report as JSON file.
+        '''
+        with open(outputFilePath, mode='w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=2)
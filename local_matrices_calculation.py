@@ -1,9 +1,71 @@
 from common import *
-from universal_element import UniversalElement, Surface
+from universal_element import UniversalElement
 from grid import Grid, GlobalData, Node
+from collections import OrderedDict
 from math import *
+import hashlib
+import json
 import numpy as np
 
+class ElementMatricesCache:
+    '''
+    LRU cache of local H, C, Hbc matrices and P vectors shared by congruent elements.
+    Elements are keyed by node coords relative to their first node (rounded to decimals), edges with border condition,
+    number of integration points and global data, so translated copies of an element are calculated only once.
+
+    maxSize:        maximum number of cached element shapes, the least recently used one is dropped when it is exceeded
+    decimals:       number of decimals of relative node coords in keys, elements differing by less are treated as identical
+    maxUniqueRatio: if the grid has more unique shapes than this fraction of its elements, it is calculated with the batched
+                    kernel without deduplication (lookups would cost more than they save)
+    hits:       number of elements whose matrices were taken from the cache (or from another element in the same call)
+    misses:     number of elements whose matrices were calculated
+    '''
+    def __init__(self, maxSize: int = 100000, decimals: int = 10, maxUniqueRatio: float = 0.1):
+        if maxSize < 1:
+            raise FiniteElementMethodException('Size of the element matrices cache must be a positive integer.')
+        self.maxSize: int = maxSize
+        self.decimals: int = decimals
+        self.maxUniqueRatio: float = maxUniqueRatio
+        self.hits: int = 0
+        self.misses: int = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hitRate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits/total if total else 0.0
+
+    def createKeys(self, elementCoords: np.ndarray, edgeMask: np.ndarray) -> np.ndarray:
+        '''
+        Returns (E,) array of keys (raw bytes) of elements given as (E, 4, 2) node coords and (E, 4) border condition edge mask.
+        '''
+        # adding 0.0 turns -0.0 into 0.0, so that both give the same bytes
+        relativeCoords = np.round(elementCoords - elementCoords[:, :1], self.decimals) + 0.0
+        keys = np.ascontiguousarray(np.column_stack((relativeCoords.reshape(-1, 8), edgeMask)), dtype=float)
+        return keys.view(np.dtype((np.void, keys.shape[1]*keys.itemsize))).ravel()
+
+    @staticmethod
+    def createPrefix(n: int, glData: GlobalData) -> bytes:
+        '''
+        Returns part of the key common to all elements of the grid: number of integration points and material data.
+        '''
+        return np.array([n, glData.conductivity, glData.density, glData.specificHeat, glData.alfa, glData.tot], dtype=float).tobytes()
+
+    def get(self, key: bytes) -> tuple:
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key: bytes, matrices: tuple) -> None:
+        self._entries[key] = matrices
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxSize:
+            self._entries.popitem(last=False)
+
 class LocalMatricesCalculation:
     '''
     Abstract class for calculating of H, C, Hbc matrices and P vector for each element of the given grid.
@@ -12,23 +74,202 @@ class LocalMatricesCalculation:
         raise FiniteElementMethodException('LocalMatricesCalculation is an abstract class, you cannot create an instance of this class.')
     
     @staticmethod
-    def calculate(n: int, grid: Grid) -> None:
+    def calculate(n: int, grid: Grid, batched: bool = False, cache: ElementMatricesCache = None, parallel: 'ParallelAssembly' = None) -> None:
         '''
-        Calculates H, C, Hbc matrices and P vector for each element in the grid, output is stored in Element class.
+        Calculates H, C, Hbc matrices and P vector for each element in the grid, output is stored in the stacked H, C, Hbc and P arrays of the grid.
+
+        batched:    if True, all elements are calculated at once with numpy broadcasting (see calculateBatched)
+        cache:      optional ElementMatricesCache, matrices are calculated once per unique element shape (see calculateDeduplicated)
+        parallel:   optional ParallelAssembly, chunks of elements are calculated by the batched kernel in its process pool
         '''
+        if parallel is not None:
+            parallel.calculateLocalMatrices(n, grid)
+            return
+        if cache is not None:
+            LocalMatricesCalculation.calculateDeduplicated(n, grid, cache, batched)
+            return
+        if batched:
+            LocalMatricesCalculation.calculateBatched(n, grid)
+            return
         uEl = UniversalElement(n)
         for element in grid.elements:
-            element.H, element.C, element.Hbc, element.P = LocalMatricesCalculation._calculateForElement([grid.nodes[element.nodeIds[0] - 1],
+            element.H, element.C = LocalMatricesCalculation._calculateForElement([grid.nodes[element.nodeIds[0] - 1],
                                       grid.nodes[element.nodeIds[1] - 1],
                                       grid.nodes[element.nodeIds[2] - 1],
                                       grid.nodes[element.nodeIds[3] - 1]],
                                       uEl, grid.globalData)
-            #print(f'H:\n{element.H}\nC:{element.C}\nHbc:\n{element.Hbc}\nP:\n{element.P}')
+            #print(f'H:\n{element.H}\nC:{element.C}')
+        grid.Hbc, grid.P = LocalMatricesCalculation._calculateBoundaryHbcAndP(grid, uEl)
+
+    @staticmethod
+    def calculateBatched(n: int, grid: Grid) -> None:
+        '''
+        Calculates H, C, Hbc matrices and P vector for all elements of the grid at once.
+        Output is stored in stacked (E, 4, 4) and (E, 4) arrays of the grid.
+        '''
+        uEl = UniversalElement(n)
+        elementCoords = grid.getElementCoords()
+        grid.H, grid.C = LocalMatricesCalculation._calculateBatchedHAndC(elementCoords, uEl, grid.globalData)
+        grid.Hbc, grid.P = LocalMatricesCalculation._calculateBoundaryHbcAndP(grid, uEl)
+
+    @staticmethod
+    def calculateDeduplicated(n: int, grid: Grid, cache: ElementMatricesCache, batched: bool = True) -> None:
+        '''
+        Calculates local matrices once per unique element shape (see ElementMatricesCache) and shares them between congruent elements.
+        Shapes missing in the cache are calculated with the batched kernel or, if batched is False, element by element.
+        Grids with more unique shapes than cache.maxUniqueRatio of elements are calculated without deduplication.
+        '''
+        uEl = UniversalElement(n)
+        elementCoords = grid.getElementCoords()
+        edgeMask = grid.bcMask[grid.connectivity] & grid.bcMask[np.roll(grid.connectivity, -1, axis=1)]
+        keys = cache.createKeys(elementCoords, edgeMask)
+        uniqueKeys, representatives, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        if len(uniqueKeys) > cache.maxUniqueRatio*len(keys):
+            cache.misses += len(keys)
+            LocalMatricesCalculation.calculate(n, grid, batched=batched)
+            return
+        prefix = ElementMatricesCache.createPrefix(n, grid.globalData)
+        uniqueKeys = [prefix + key.tobytes() for key in uniqueKeys]
+
+        H = np.empty((len(uniqueKeys), 4, 4)); C = np.empty_like(H); Hbc = np.empty_like(H); P = np.empty((len(uniqueKeys), 4))
+        missing: list[int] = []
+        if len(cache) == 0:
+            # nothing to look up in an empty cache (i.e. a new cache of a single run)
+            missing = list(range(len(uniqueKeys)))
+        else:
+            for i, key in enumerate(uniqueKeys):
+                matrices = cache.get(key)
+                if matrices is None:
+                    missing.append(i)
+                else:
+                    H[i], C[i], Hbc[i], P[i] = matrices
+        if missing:
+            missingElements = representatives[missing]
+            if batched:
+                H[missing], C[missing] = LocalMatricesCalculation._calculateBatchedHAndC(elementCoords[missingElements], uEl, grid.globalData)
+            else:
+                for i, element in zip(missing, missingElements):
+                    H[i], C[i] = LocalMatricesCalculation._calculateForElement([grid.nodes[node] for node in grid.connectivity[element]],
+                                                                               uEl, grid.globalData)
+            Hbc[missing], P[missing] = LocalMatricesCalculation._calculateBoundaryForElements(elementCoords[missingElements],
+                                                                                              edgeMask[missingElements], uEl, grid.globalData)
+            # only the last maxSize shapes would stay in the cache
+            for i in missing[-cache.maxSize:]:
+                cache.put(uniqueKeys[i], (H[i], C[i], Hbc[i], P[i]))
+        cache.misses += len(missing)
+        cache.hits += len(keys) - len(missing)
+        inverse = inverse.ravel()
+        grid.H, grid.C, grid.Hbc, grid.P = H[inverse], C[inverse], Hbc[inverse], P[inverse]
+
+    @staticmethod
+    def calculateCached(n: int, grid: Grid, cacheFilePath: str, elementCache: ElementMatricesCache = None) -> bool:
+        '''
+        Reads local matrices from cacheFilePath if they were calculated for the same mesh, global data and n,
+        otherwise calculates them with the batched kernel (deduplicated with elementCache if given) and saves them,
+        replacing matrices of any other grid in the file, so a single file is kept per cacheFilePath.
+        Returns True on cache hit.
+        '''
+        key = LocalMatricesCalculation._getCacheKey(n, grid)
+        if os.path.isfile(cacheFilePath):
+            with np.load(cacheFilePath) as data:
+                if 'key' in data and str(data['key']) == key:
+                    grid.H, grid.C, grid.Hbc, grid.P = data['H'], data['C'], data['Hbc'], data['P']
+                    return True
+        LocalMatricesCalculation.calculate(n, grid, batched=True, cache=elementCache)
+        os.makedirs(os.path.dirname(os.path.abspath(cacheFilePath)), exist_ok=True)
+        temporaryPath = f'{cacheFilePath}.{os.getpid()}.tmp'
+        with open(temporaryPath, 'wb') as f:
+            np.savez(f, key=np.array(key), H=grid.H, C=grid.C, Hbc=grid.Hbc, P=grid.P)
+        os.replace(temporaryPath, cacheFilePath)
+        return False
+
+    @staticmethod
+    def _getCacheKey(n: int, grid: Grid) -> str:
+        '''
+        Returns hash of mesh, global data and n identifying cached local matrices.
+        '''
+        key = json.dumps([grid.getMeshHash(), grid.globalData.toDict(), n], sort_keys=True, default=float)
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def calculateHbcAndP(n: int, grid: Grid) -> None:
+        '''
+        Recalculates only Hbc matrices and P vectors, i.e. after changing alfa or tot.
+        Boundary edge index of the grid is reused.
+        '''
+        grid.Hbc, grid.P = LocalMatricesCalculation._calculateBoundaryHbcAndP(grid, UniversalElement(n))
+
+    @staticmethod
+    def _calculateBatchedHAndC(elementCoords: np.ndarray, uEl: UniversalElement, glData: GlobalData) -> tuple[np.ndarray]:
+        '''
+        Calculates H and C matrices for every element given as (E, 4, 2) array of node coords.
+        Returns two (E, 4, 4) arrays.
+
+        jac:    Jacobian matrices in every integration point (E, n^2, 2, 2)
+        detJ:   Jacobian determinants in every integration point (E, n^2)
+        '''
+        dNdKsi = np.asarray(uEl.dNdKsiTab, dtype=float)
+        dNdEta = np.asarray(uEl.dNdEtaTab, dtype=float)
+        N = np.asarray(uEl.NTab, dtype=float)
+        weights = np.asarray(uEl.weights, dtype=float)
+        # weight of integration point j is weights[j//n]*weights[j%n]
+        ipWeights = np.outer(weights, weights).ravel()
+
+        # jac[e, j] = [[dx/dksi, dy/dksi], [dx/deta, dy/deta]]
+        jac = np.stack((np.einsum('pi,eik->epk', dNdKsi, elementCoords),
+                        np.einsum('pi,eik->epk', dNdEta, elementCoords)), axis=2)
+        detJ = jac[..., 0, 0]*jac[..., 1, 1] - jac[..., 0, 1]*jac[..., 1, 0]
+        # (1/detJ)*[[dy/deta, -dy/dksi], [-dx/deta, dx/dksi]] = J^(-1)
+        dNdX = (jac[..., 1, 1, None]*dNdKsi - jac[..., 0, 1, None]*dNdEta)/detJ[..., None]
+        dNdY = (jac[..., 0, 0, None]*dNdEta - jac[..., 1, 0, None]*dNdKsi)/detJ[..., None]
+
+        weightedDet = detJ*ipWeights
+        H = glData.conductivity*(np.einsum('ep,epi,epj->eij', weightedDet, dNdX, dNdX, optimize=True)
+                                 + np.einsum('ep,epi,epj->eij', weightedDet, dNdY, dNdY, optimize=True))
+        C = glData.specificHeat*glData.density*np.einsum('ep,pi,pj->eij', weightedDet, N, N, optimize=True)
+        return H, C
+
+    @staticmethod
+    def _calculateBoundaryHbcAndP(grid: Grid, uEl: UniversalElement) -> tuple[np.ndarray]:
+        '''
+        Calculates Hbc matrices and P vectors of all elements in a single pass over boundary edges of the grid.
+        Returns (E, 4, 4) and (E, 4) arrays.
+        '''
+        surfaceNN, surfaceNSum = LocalMatricesCalculation._surfaceIntegrals(uEl)
+        edges = grid.getBoundaryEdges()
+        detJ = edges.lengths/2
+        Hbc = np.zeros((len(grid.connectivity), 4, 4))
+        P = np.zeros((len(grid.connectivity), 4))
+        np.add.at(Hbc, edges.elementIndices, grid.globalData.alfa*detJ[:, None, None]*surfaceNN[edges.localEdges])
+        np.add.at(P, edges.elementIndices, grid.globalData.alfa*grid.globalData.tot*detJ[:, None]*surfaceNSum[edges.localEdges])
+        return Hbc, P
+
+    @staticmethod
+    def _calculateBoundaryForElements(elementCoords: np.ndarray, edgeMask: np.ndarray, uEl: UniversalElement, glData: GlobalData) -> tuple[np.ndarray]:
+        '''
+        Calculates Hbc matrices and P vectors of elements given as (K, 4, 2) node coords and (K, 4) mask of edges with border condition.
+        Returns (K, 4, 4) and (K, 4) arrays.
+        '''
+        surfaceNN, surfaceNSum = LocalMatricesCalculation._surfaceIntegrals(uEl)
+        detJ = edgeMask*np.linalg.norm(np.roll(elementCoords, -1, axis=1) - elementCoords, axis=2)/2
+        Hbc = glData.alfa*np.einsum('ks,sij->kij', detJ, surfaceNN)
+        P = glData.alfa*glData.tot*(detJ @ surfaceNSum)
+        return Hbc, P
 
     @staticmethod
-    def _calculateForElement(nodes: list[Node], uEl: UniversalElement, glData: GlobalData) -> None:
+    def _surfaceIntegrals(uEl: UniversalElement) -> tuple[np.ndarray]:
         '''
-        Calculates H, C, Hbc marices and P vector for the element.
+        Returns integrals of N*N^T (4, 4, 4) and N (4, 4) over every surface of the universal element.
+        Surface i spans local nodes i and (i+1)%4 (down, right, up, left).
+        '''
+        weights = np.asarray(uEl.weights, dtype=float)
+        surfaceN = np.array([surface.N for surface in uEl.surfaces], dtype=float)
+        return np.einsum('q,sqi,sqj->sij', weights, surfaceN, surfaceN), np.einsum('q,sqi->si', weights, surfaceN)
+
+    @staticmethod
+    def _calculateForElement(nodes: list[Node], uEl: UniversalElement, glData: GlobalData) -> tuple[np.ndarray]:
+        '''
+        Calculates H and C marices for the element.
         '''
         xCoords, yCoords = LocalMatricesCalculation._fillXYCoords(nodes)
         dXdKsiTab, dXdEtaTab, dYdKsiTab, dYdEtaTab = LocalMatricesCalculation._fillXYKsiEtaTabs(xCoords, yCoords, uEl)
@@ -37,22 +278,11 @@ class LocalMatricesCalculation:
         
         H = np.zeros((4, 4))
         C = np.zeros((4, 4))
-        Hbc = np.zeros((4, 4))
-        P = np.zeros((4, 1))
 
         for i in range(0, uEl.n*uEl.n):
             H += ipHMatrices[i]*(uEl.weights[i//uEl.n])*(uEl.weights[i%uEl.n])
             C += ipCMatrices[i]*(uEl.weights[i//uEl.n])*(uEl.weights[i%uEl.n])
-
-        tempList = []
-        tempList.append(LocalMatricesCalculation._calculateForSurface(uEl.surfaces[0], (nodes[0], nodes[1]), uEl.weights, uEl.n, glData.alfa, glData.tot))
-        tempList.append(LocalMatricesCalculation._calculateForSurface(uEl.surfaces[1], (nodes[1], nodes[2]), uEl.weights, uEl.n, glData.alfa, glData.tot))
-        tempList.append(LocalMatricesCalculation._calculateForSurface(uEl.surfaces[2], (nodes[2], nodes[3]), uEl.weights, uEl.n, glData.alfa, glData.tot))
-        tempList.append(LocalMatricesCalculation._calculateForSurface(uEl.surfaces[3], (nodes[3], nodes[0]), uEl.weights, uEl.n, glData.alfa, glData.tot))
-        for surfaceHbc, surfaceP in tempList:
-            Hbc+=surfaceHbc
-            P+=surfaceP
-        return H, C, Hbc, P
+        return H, C
     
     @staticmethod
     def _fillXYCoords(nodes: list[Node]) -> tuple[list[float]]:
@@ -151,28 +381,6 @@ class LocalMatricesCalculation:
             mxCTab.append(ipMxC)
         return mxHTab, mxCTab
     
-    @staticmethod
-    def _calculateForSurface(surface: Surface, nodes: tuple[Node], weights: list[float], n: int, alfa: int, tot: int) -> tuple:
-        '''
-        Calculates Hbc matrix and P vector for the given surface of the element.
-        '''
-        Hbc = np.zeros((4, 4))
-        P = np.zeros((4, 1))
-        if nodes[0].BC == 0 or nodes[1].BC == 0:
-            return Hbc, P
-        L = sqrt(pow(nodes[0].x-nodes[1].x, 2)+pow(nodes[0].y-nodes[1].y, 2))
-        detJ = L/2
-        for i in range(0, n):
-            mx = np.array([[surface.N[i][0]],
-                            [surface.N[i][1]],
-                            [surface.N[i][2]],
-                            [surface.N[i][3]]])
-            Hbc += np.matmul(mx, mx.transpose())*weights[i]
-            P += mx*weights[i]
-        Hbc = Hbc*alfa*detJ
-        P = P*alfa*tot*detJ
-        return Hbc, P
-    
     @staticmethod
     def _interpolate(dN1: float, dN2: float, dN3: float, dN4: float, var: list[float]) -> float:
         '''
@@ -1,5 +1,17 @@
 from common import *
+from functools import lru_cache
 from math import *
+import numpy as np
+
+@lru_cache(maxsize=None)
+def gaussLegendre(n: int) -> tuple[np.ndarray]:
+    '''
+    Returns read-only arrays of n Gauss-Legendre points and weights on [-1, 1].
+    '''
+    points, weights = np.polynomial.legendre.leggauss(n)
+    points.flags.writeable = False
+    weights.flags.writeable = False
+    return points, weights
 
 class GaussianQuadrature:
     '''
@@ -7,94 +19,91 @@ class GaussianQuadrature:
     
     fun:        function to integrate
     n:          number of integration points
-    points:     list of integration points, xi
-    weights:    weights for integration points, wi
+    points:     array of integration points, xi
+    weights:    array of weights for integration points, wi
     '''
     def __init__(self, n: int, fun):
         self.fun = fun
         self.n: int = n
-        self.points: list[float] = []
-        self.weights: list[float] = []
+        self.points: np.ndarray = None
+        self.weights: np.ndarray = None
         self.initPointsAndWeights()
 
     def initPointsAndWeights(self) -> None:
         '''
-        Initializes lists containing integration points and their weights.
+        Initializes arrays containing Gauss-Legendre integration points and their weights, memoized per n.
         '''
-        match self.n:
-            case 1:
-                self.points = [0]
-                self.weights = [2]
-            case 2:
-                self.points = [
-                    -sqrt(1/3),
-                    sqrt(1/3)
-                ]
-                self.weights = [
-                    1,
-                    1
-                ]
-            case 3:
-                self.points = [
-                    -sqrt(3/5),
-                    0,
-                    sqrt(3/5)
-                ]
-                self.weights = [
-                    5/9,
-                    8/9,
-                    5/9
-                ]
-            case 4:
-                self.points = [
-                    -sqrt(3/7 + 2/7*sqrt(6/5)),
-                    -sqrt(3/7 - 2/7*sqrt(6/5)),
-                    sqrt(3/7 - 2/7*sqrt(6/5)),
-                    sqrt(3/7 + 2/7*sqrt(6/5))
-                ]
-                self.weights = [
-                    
-                    (18 - sqrt(30))/36,
-                    (18 + sqrt(30))/36,
-                    (18 + sqrt(30))/36,
-                    (18 - sqrt(30))/36
-                ]
-            case 5:
-                self.points = [
-                    -(1/3)*sqrt(5 + 2*sqrt(10/7)),
-                    -(1/3)*sqrt(5 - 2*sqrt(10/7)),
-                    0,
-                    (1/3)*sqrt(5 - 2*sqrt(10/7)),
-                    (1/3)*sqrt(5 + 2*sqrt(10/7))
-                ]
-                self.weights = [
-                    (322 - 13*sqrt(70))/900,
-                    (322 + 13*sqrt(70))/900,
-                    128/225,
-                    (322 + 13*sqrt(70))/900,
-                    (322 - 13*sqrt(70))/900
-                ]
-            case _:
-                raise FiniteElementMethodException('Number of nodes in numerical integration (n) must be an integer in range (1;5).')      
+        if not isinstance(self.n, (int, np.integer)) or self.n < 1:
+            raise FiniteElementMethodException('Number of nodes in numerical integration (n) must be a positive integer.')
+        self.points, self.weights = gaussLegendre(int(self.n))
 
-    def calculateIntegral1d(self) -> float:
+    def calculateIntegral1d(self, vectorized: bool = False, parameters: np.ndarray = None):
         '''
         Calculates integral for function of 1 variable f(x).
+
+        vectorized:     if True, fun is called once with the array of all points and may return array (..., n),
+                        result is an array of integrals (...)
+        parameters:     (k,) array of parameter sets, fun is called as f(x, p) with p of shape (k, 1),
+                        result is an array of k integrals (implies vectorized)
         '''
+        if vectorized or parameters is not None:
+            args = (self.points,) if parameters is None else (self.points, np.asarray(parameters)[:, None])
+            values = GaussianQuadrature._evaluate(self.fun, args, (self.n,))
+            return GaussianQuadrature._toResult(values @ self.weights)
         result = 0.0
         for i in range (0, self.n):
             x = self.points[i]
             result += self.weights[i] * self.fun(x)
         return result
     
-    def calculateIntegral2d(self) -> float:
+    def calculateIntegral2d(self, vectorized: bool = False, parameters: np.ndarray = None):
         '''
         Calculates integral for function of 2 variables f(x, y).
+
+        vectorized:     if True, fun is called once with (n, n) arrays of the tensor-product grid of points (x varies along the first axis)
+                        and may return array (..., n, n), result is an array of integrals (...)
+        parameters:     (k,) array of parameter sets, fun is called as f(x, y, p) with p of shape (k, 1, 1),
+                        result is an array of k integrals (implies vectorized)
         '''
+        if vectorized or parameters is not None:
+            x, y = np.meshgrid(self.points, self.points, indexing='ij')
+            args = (x, y) if parameters is None else (x, y, np.asarray(parameters)[:, None, None])
+            values = GaussianQuadrature._evaluate(self.fun, args, (self.n, self.n))
+            return GaussianQuadrature._toResult(np.einsum('...ij,i,j->...', values, self.weights, self.weights))
         result = 0.0
         for i in range (0, self.n):
             x = self.points[i]
             for j in range (self.n):
                 y = self.points[j]
                 result += self.weights[i] * self.weights[j] * self.fun(x, y)
-        return result
\ No newline at end of file
+        return result
+
+    def calculateIntegrals1d(self, funs: list) -> np.ndarray:
+        '''
+        Calculates integrals of many vectorized functions of 1 variable. Returns array of results.
+        '''
+        values = np.stack([GaussianQuadrature._evaluate(fun, (self.points,), (self.n,)) for fun in funs])
+        return values @ self.weights
+
+    def calculateIntegrals2d(self, funs: list) -> np.ndarray:
+        '''
+        Calculates integrals of many vectorized functions of 2 variables. Returns array of results.
+        '''
+        x, y = np.meshgrid(self.points, self.points, indexing='ij')
+        values = np.stack([GaussianQuadrature._evaluate(fun, (x, y), (self.n, self.n)) for fun in funs])
+        return np.einsum('...ij,i,j->...', values, self.weights, self.weights)
+
+    @staticmethod
+    def _evaluate(fun, args: tuple, pointsShape: tuple) -> np.ndarray:
+        '''
+        Calls fun with arrays of points, result is broadcast so that its last axes match points (i.e. for constant functions).
+        '''
+        values = np.asarray(fun(*args), dtype=float)
+        return np.broadcast_to(values, np.broadcast_shapes(values.shape, pointsShape))
+
+    @staticmethod
+    def _toResult(result: np.ndarray):
+        '''
+        Returns float for a single integral, array otherwise.
+        '''
+        return float(result) if np.ndim(result) == 0 else result
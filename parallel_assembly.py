@@ -0,0 +1,184 @@
+from common import *
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from grid import Grid, GlobalData
+from local_matrices_calculation import LocalMatricesCalculation
+from system_of_equations import SystemOfEquations
+from universal_element import UniversalElement
+import numpy as np
+from scipy import sparse
+
+class ParallelAssembly:
+    '''
+    Calculates local matrices and assembles global matrices in a process pool.
+    Elements are split into chunks, input and output arrays live in shared memory blocks, so workers read and write
+    them in place and only chunk bounds are sent to them. Every chunk is assembled into its own CSR matrix
+    (duplicated COO entries summed by the worker), chunk matrices are added up in the main process.
+    calculateLocalMatrices assembles chunks in the same tasks that calculate their local matrices, the global matrices
+    are kept until assemble is called for the grid, so local matrices are neither copied back to shared memory
+    nor sent to a second pool.
+
+    workers:    number of processes, None means number of CPUs, 1 calculates everything in the current process
+    chunkSize:  number of elements in a single task
+    '''
+    def __init__(self, workers: int = None, chunkSize: int = 50000):
+        if chunkSize < 1:
+            raise FiniteElementMethodException('Chunk size must be a positive integer.')
+        self.workers: int = workers or os.cpu_count()
+        self.chunkSize: int = chunkSize
+        self._assembled: tuple = None
+
+    def _chunks(self, elementsNumber: int) -> list[tuple[int]]:
+        return [(start, min(start + self.chunkSize, elementsNumber)) for start in range(0, elementsNumber, self.chunkSize)]
+
+    def calculateLocalMatrices(self, n: int, grid: Grid) -> None:
+        '''
+        Calculates H, C, Hbc matrices and P vectors of all elements, output is stored in the stacked arrays of the grid.
+        Global matrices of the grid connectivity are assembled by the same tasks and kept for assemble().
+        '''
+        elementCoords = grid.getElementCoords()
+        edgeMask = grid.bcMask[grid.connectivity] & grid.bcMask[np.roll(grid.connectivity, -1, axis=1)]
+        elementsNumber = len(elementCoords)
+        dim = len(grid.nodeCoords)
+        if self.workers == 1:
+            results = []
+            for start, stop in self._chunks(elementsNumber):
+                H, C, Hbc, P = _calculateLocalMatrices(elementCoords[start:stop], edgeMask[start:stop], n, grid.globalData)
+                grid.H[start:stop], grid.C[start:stop], grid.Hbc[start:stop], grid.P[start:stop] = H, C, Hbc, P
+                results.append(_assemble(grid.connectivity[start:stop], H + Hbc, C, P, dim))
+        else:
+            outputs = {
+                'H': ((elementsNumber, 4, 4), np.float64),
+                'C': ((elementsNumber, 4, 4), np.float64),
+                'Hbc': ((elementsNumber, 4, 4), np.float64),
+                'P': ((elementsNumber, 4), np.float64)
+            }
+            inputs = {'elementCoords': elementCoords, 'edgeMask': edgeMask, 'connectivity': grid.connectivity}
+            with _sharedArrays(inputs, outputs) as (arrays, descriptions):
+                tasks = [(start, stop, n, grid.globalData.toDict(), dim) for start, stop in self._chunks(elementsNumber)]
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_attachSharedArrays, initargs=(descriptions,)) as executor:
+                    results = list(executor.map(_calculateAndAssembleChunk, tasks))
+                grid.H, grid.C, grid.Hbc, grid.P = (np.array(arrays[name]) for name in ('H', 'C', 'Hbc', 'P'))
+        self._assembled = (grid, grid.getLocalMatrices(), _mergeResults(results, dim))
+
+    def assemble(self, grid: Grid, connectivity: np.ndarray = None) -> tuple:
+        '''
+        Returns global H + Hbc and C matrices in CSR format and global (dim, 1) P vector assembled from local matrices of the grid.
+        Matrices assembled by calculateLocalMatrices are returned (with renumbered nodes if connectivity is renumbered)
+        if local matrices of the grid were not replaced since, otherwise they are assembled in the process pool.
+
+        connectivity:   connectivity used for assembly (i.e. renumbered one), connectivity of the grid by default
+        '''
+        connectivity = grid.connectivity if connectivity is None else connectivity
+        dim = len(grid.nodeCoords)
+        assembled, self._assembled = self._assembled, None
+        if assembled is not None and assembled[0] is grid and all(a is b for a, b in zip(assembled[1], grid.getLocalMatrices())):
+            nodeMap = np.arange(dim)
+            nodeMap[grid.connectivity.ravel()] = connectivity.ravel()
+            if np.array_equal(nodeMap[grid.connectivity], connectivity) and np.array_equal(np.sort(nodeMap), np.arange(dim)):
+                return _renumber(*assembled[2], nodeMap)
+        H, C, Hbc, P = grid.getLocalMatrices()
+        chunks = self._chunks(len(connectivity))
+        if self.workers == 1:
+            results = [_assemble(connectivity[start:stop], H[start:stop] + Hbc[start:stop], C[start:stop], P[start:stop], dim) for start, stop in chunks]
+        else:
+            inputs = {'connectivity': connectivity, 'H': H, 'Hbc': Hbc, 'C': C, 'P': P}
+            with _sharedArrays(inputs, {}) as (_, descriptions):
+                with ProcessPoolExecutor(max_workers=self.workers, initializer=_attachSharedArrays, initargs=(descriptions,)) as executor:
+                    results = list(executor.map(_assembleChunk, [(start, stop, dim) for start, stop in chunks]))
+        return _mergeResults(results, dim)
+
+@contextmanager
+def _sharedArrays(inputs: dict, outputs: dict):
+    '''
+    Copies input arrays to new shared memory blocks and creates empty output blocks of given (shape, dtype).
+    Yields dict of arrays and their descriptions (name -> (block name, shape, dtype)) for workers, blocks are released at exit.
+    '''
+    blocks: list[SharedMemory] = []
+    arrays: dict = {}
+    descriptions: dict = {}
+    try:
+        for name, (shape, dtype) in {**{name: (array.shape, array.dtype) for name, array in inputs.items()}, **outputs}.items():
+            block = SharedMemory(create=True, size=max(1, int(np.prod(shape))*np.dtype(dtype).itemsize))
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            if name in inputs:
+                arrays[name][...] = inputs[name]
+            descriptions[name] = (block.name, shape, np.dtype(dtype).str)
+        yield arrays, descriptions
+    finally:
+        arrays.clear()
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+def _mergeResults(results: list[tuple], dim: int) -> tuple:
+    '''
+    Returns global H, C matrices and P vector from (H, C, P) of all chunks.
+    '''
+    HChunks, CChunks, PChunks = zip(*results)
+    return _merge(HChunks, dim), _merge(CChunks, dim), np.sum(PChunks, axis=0)
+
+def _renumber(H: sparse.csr_matrix, C: sparse.csr_matrix, P: np.ndarray, nodeMap: np.ndarray) -> tuple:
+    '''
+    Returns global matrices with node i moved to nodeMap[i] (returned unchanged for identity map).
+    '''
+    if np.array_equal(nodeMap, np.arange(len(nodeMap))):
+        return H, C, P
+    renumbered = []
+    for matrix in (H, C):
+        matrix = matrix.tocoo()
+        renumbered.append(sparse.csr_matrix((matrix.data, (nodeMap[matrix.row], nodeMap[matrix.col])), shape=matrix.shape))
+    renumberedP = np.empty_like(P)
+    renumberedP[nodeMap] = P
+    return renumbered[0], renumbered[1], renumberedP
+
+def _merge(chunks: list[sparse.csr_matrix], dim: int) -> sparse.csr_matrix:
+    '''
+    Merges chunk matrices in a single COO to CSR conversion, only entries of nodes shared by chunks are summed again.
+    '''
+    chunks = [chunk.tocoo() for chunk in chunks]
+    rows = np.concatenate([chunk.row for chunk in chunks])
+    cols = np.concatenate([chunk.col for chunk in chunks])
+    values = np.concatenate([chunk.data for chunk in chunks])
+    return sparse.coo_matrix((values, (rows, cols)), shape=(dim, dim)).tocsr()
+
+_sharedBlocks: list[SharedMemory] = []
+_shared: dict = {}
+
+def _attachSharedArrays(descriptions: dict) -> None:
+    '''
+    Maps shared memory blocks in the worker process (once per worker).
+    Workers share the resource tracker of the main process, which unlinks the blocks.
+    '''
+    for name, (blockName, shape, dtype) in descriptions.items():
+        block = SharedMemory(name=blockName)
+        _sharedBlocks.append(block)
+        _shared[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def _calculateLocalMatrices(elementCoords: np.ndarray, edgeMask: np.ndarray, n: int, glData: GlobalData) -> tuple[np.ndarray]:
+    uEl = UniversalElement(n)
+    H, C = LocalMatricesCalculation._calculateBatchedHAndC(elementCoords, uEl, glData)
+    Hbc, P = LocalMatricesCalculation._calculateBoundaryForElements(elementCoords, edgeMask, uEl, glData)
+    return H, C, Hbc, P
+
+def _calculateLocalMatricesChunk(task: tuple) -> None:
+    start, stop, n, globalDataDict = task
+    results = _calculateLocalMatrices(_shared['elementCoords'][start:stop], _shared['edgeMask'][start:stop], n, GlobalData(globalDataDict))
+    for name, result in zip(('H', 'C', 'Hbc', 'P'), results):
+        _shared[name][start:stop] = result
+
+def _assemble(connectivity: np.ndarray, H: np.ndarray, C: np.ndarray, P: np.ndarray, dim: int) -> tuple:
+    return (SystemOfEquations.assembleSparse(connectivity, H, dim), SystemOfEquations.assembleSparse(connectivity, C, dim),
+            SystemOfEquations.assembleVector(connectivity, P, dim))
+
+def _calculateAndAssembleChunk(task: tuple) -> tuple:
+    start, stop, n, globalDataDict, dim = task
+    _calculateLocalMatricesChunk((start, stop, n, globalDataDict))
+    return _assembleChunk((start, stop, dim))
+
+def _assembleChunk(task: tuple) -> tuple:
+    start, stop, dim = task
+    return _assemble(_shared['connectivity'][start:stop], _shared['H'][start:stop] + _shared['Hbc'][start:stop], _shared['C'][start:stop],
+                     _shared['P'][start:stop], dim)
@@ -0,0 +1,116 @@
+from common import *
+from concurrent.futures import ProcessPoolExecutor
+from grid import Grid, GlobalData
+from local_matrices_calculation import LocalMatricesCalculation
+from system_of_equations import SystemOfEquations
+from itertools import product
+import numpy as np
+
+class ParameterSweep:
+    '''
+    Runs the same grid with many combinations of Conductivity, Density, SpecificHeat, Alfa, Tot, InitialTemp etc.
+
+    Local matrices depend on the parameters only through coefficients: H ~ conductivity, C ~ density*specificHeat,
+    Hbc ~ alfa, P ~ alfa*tot. Global matrices are therefore assembled once for unit coefficients and every
+    scenario only scales and adds them.
+
+    grid:               grid of the sweep, its global data are the defaults of every scenario
+    solverOptions:      keyword arguments passed to SystemOfEquations (sparse storage is always used)
+    unitMatrices:       global H, Hbc, C matrices and P vector for unit coefficients
+    '''
+    sweptParameters: tuple[str] = ('SimulationTime', 'SimulationStepTime', 'Conductivity', 'Alfa', 'Tot', 'InitialTemp', 'Density', 'SpecificHeat')
+
+    def __init__(self, n: int, grid: Grid, **solverOptions):
+        self.grid: Grid = grid
+        self.solverOptions: dict = {**solverOptions, 'sparse': True}
+        unitGrid = Grid(GlobalData({**grid.globalData.toDict(), 'Conductivity': 1, 'Alfa': 1, 'Tot': 1, 'Density': 1, 'SpecificHeat': 1}),
+                        grid.nodeCoords, grid.connectivity, grid.bcMask, grid.elementIds)
+        LocalMatricesCalculation.calculate(n, unitGrid, batched=True)
+        dim = len(grid.nodeCoords)
+        self.unitLocalMatrices: tuple[np.ndarray] = unitGrid.getLocalMatrices()
+        H, C, Hbc, P = self.unitLocalMatrices
+        self.unitMatrices: tuple = (
+            SystemOfEquations.assembleSparse(grid.connectivity, H, dim),
+            SystemOfEquations.assembleSparse(grid.connectivity, Hbc, dim),
+            SystemOfEquations.assembleSparse(grid.connectivity, C, dim),
+            SystemOfEquations.assembleVector(grid.connectivity, P, dim)
+        )
+
+    @staticmethod
+    def combinations(**values: list) -> list[dict]:
+        '''
+        Returns all combinations of given parameter values, i.e. combinations(Conductivity=[25, 30], Alfa=[300, 400]).
+        '''
+        names = list(values)
+        return [dict(zip(names, combination)) for combination in product(*values.values())]
+
+    def run(self, scenarios: list[dict], workers: int = None, keepHistory: bool = False) -> list[dict]:
+        '''
+        Simulates every scenario (dict of parameters overriding global data of the grid) in a process pool.
+        Returns results in the order of scenarios: parameters, times, min and max temperatures of every step,
+        final temperatures and, if keepHistory is True, temperatures of every step.
+
+        workers:    number of processes, None means number of CPUs, 1 runs scenarios in the current process
+        '''
+        for scenario in scenarios:
+            unknown = set(scenario) - set(ParameterSweep.sweptParameters)
+            if unknown:
+                raise FiniteElementMethodException(f'Unknown parameters {", ".join(sorted(unknown))}, available parameters: {", ".join(ParameterSweep.sweptParameters)}.')
+        if workers == 1:
+            _initializeWorker(self, keepHistory)
+            return [_runScenario(scenario) for scenario in scenarios]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_initializeWorker, initargs=(self, keepHistory)) as executor:
+            return list(executor.map(_runScenario, scenarios))
+
+    def createSystemOfEquations(self, scenario: dict) -> SystemOfEquations:
+        '''
+        Creates system of equations of the scenario from scaled unit matrices.
+        '''
+        globalData = GlobalData({**self.grid.globalData.toDict(), **scenario})
+        H, Hbc, C, P = self.unitMatrices
+        grid = Grid(globalData, self.grid.nodeCoords, self.grid.connectivity, self.grid.bcMask, self.grid.elementIds)
+        if self.solverOptions.get('integrator') == 'explicit':
+            # stable step is estimated from local matrices
+            unitH, unitC, unitHbc, _ = self.unitLocalMatrices
+            grid.H = globalData.conductivity*unitH
+            grid.C = globalData.density*globalData.specificHeat*unitC
+            grid.Hbc = globalData.alfa*unitHbc
+        matrices = (
+            globalData.conductivity*H + globalData.alfa*Hbc,
+            globalData.density*globalData.specificHeat*C,
+            globalData.alfa*globalData.tot*P
+        )
+        return SystemOfEquations(grid, matrices=matrices, **self.solverOptions)
+
+_workerSweep: ParameterSweep = None
+_workerKeepHistory: bool = False
+
+def _initializeWorker(sweep: ParameterSweep, keepHistory: bool) -> None:
+    '''
+    Stores the sweep in the worker process, so that unit matrices are sent to every worker only once.
+    '''
+    global _workerSweep, _workerKeepHistory
+    _workerSweep = sweep
+    _workerKeepHistory = keepHistory
+
+def _runScenario(scenario: dict) -> dict:
+    '''
+    Simulates a single scenario in the worker process.
+    '''
+    soe = _workerSweep.createSystemOfEquations(scenario)
+    globalData = GlobalData({**_workerSweep.grid.globalData.toDict(), **scenario})
+    result: dict = {'parameters': scenario, 'times': [], 'minTemps': [], 'maxTemps': []}
+    if _workerKeepHistory:
+        result['temperatures'] = []
+    tau0: float = 0
+    temperatures: np.ndarray = soe.t0
+    while tau0 < globalData.simulationTime:
+        temperatures = soe.solve()
+        result['times'].append(soe.dTau)
+        result['minTemps'].append(float(temperatures.min()))
+        result['maxTemps'].append(float(temperatures.max()))
+        if _workerKeepHistory:
+            result['temperatures'].append(temperatures)
+        tau0 += globalData.simulationStepTime
+    result['finalTemperatures'] = temperatures
+    return result
@@ -0,0 +1,215 @@
+from common import *
+from grid import Grid, GlobalData
+from vtk_writer import VtuWriter, VtkTemplateWriter
+import json
+import numpy as np
+
+class ResultStore:
+    '''
+    Single binary file with the results of a simulation: header, mesh arrays and (steps, nodes) temperatures.
+    Steps are appended one by one, readers memory-map the file, so any frame or history of any node
+    is read without loading the whole run.
+
+    Layout (little endian, sections aligned to 64 bytes):
+    magic (8 bytes), header length (UInt64), JSON header, node coords (nodes, 2) Float64,
+    connectivity (elements, 4) Int64, boundary condition mask (nodes,) UInt8,
+    records of steps: time (Float64) followed by temperatures (nodes,) of the stored dtype.
+    The number of steps is derived from the file size, an incomplete last record (i.e. after a crash) is ignored.
+
+    filePath:       path to the file
+    header:         dict with nodesNumber, elementsNumber, dtype and globalData of the grid
+    destinationDir: directory of the file (store can be used as a frame writer, see writeFrame and close)
+    '''
+    magic: bytes = b'FEMRES01'
+    alignment: int = 64
+
+    def __init__(self, filePath: str, header: dict):
+        self.filePath: str = filePath
+        self.header: dict = header
+        self.destinationDir: str = os.path.dirname(os.path.abspath(filePath))
+        self._offsets: dict = ResultStore._layout(header)
+        self._recordType: np.dtype = np.dtype([('time', '<f8'), ('temperatures', header['dtype'], (header['nodesNumber'],))])
+        self._file = None
+        self._records: np.memmap = None
+
+    @staticmethod
+    def create(filePath: str, grid: Grid, dtype: type = np.float64) -> 'ResultStore':
+        '''
+        Creates new store (existing file is overwritten) with mesh of the grid, opened for appending steps.
+        '''
+        nodeCoords = np.ascontiguousarray(grid.getNodeCoords(), dtype='<f8')
+        connectivity = np.ascontiguousarray(grid.getConnectivity(), dtype='<i8')
+        header: dict = {
+            'nodesNumber': len(nodeCoords),
+            'elementsNumber': len(connectivity),
+            'dtype': np.dtype(dtype).newbyteorder('<').str,
+            'globalData': grid.globalData.toDict()
+        }
+        store = ResultStore(filePath, header)
+        with open(filePath, mode='wb') as file:
+            file.write(ResultStore._encodeHeader(header))
+            for name, array in (('nodeCoords', nodeCoords), ('connectivity', connectivity), ('bcMask', grid.getBcMask().astype('u1'))):
+                file.seek(store._offsets[name])
+                file.write(array.tobytes())
+            file.truncate(store._offsets['records'])
+        store._file = open(filePath, mode='ab')
+        return store
+
+    @staticmethod
+    def open(filePath: str) -> 'ResultStore':
+        '''
+        Opens existing store for reading.
+        '''
+        with open(filePath, mode='rb') as file:
+            if file.read(len(ResultStore.magic)) != ResultStore.magic:
+                raise FiniteElementMethodException(f'{filePath} is not a result store file.')
+            headerLength = int(np.frombuffer(file.read(8), dtype='<u8')[0])
+            header: dict = json.loads(file.read(headerLength).decode('utf-8'))
+        return ResultStore(filePath, header)
+
+    @staticmethod
+    def resume(filePath: str, endTime: float, tolerance: float = 1e-9) -> 'ResultStore':
+        '''
+        Opens existing store for appending, steps after endTime (i.e. written after the checkpoint of a restarted run)
+        and incomplete last record are removed.
+        '''
+        store = ResultStore.open(filePath)
+        keptSteps = int(np.count_nonzero(store.times <= endTime + tolerance))
+        store._records = None
+        with open(filePath, mode='r+b') as file:
+            file.truncate(store._offsets['records'] + keptSteps*store._recordType.itemsize)
+        store._file = open(filePath, mode='ab')
+        return store
+
+    @staticmethod
+    def _encodeHeader(header: dict) -> bytes:
+        content = json.dumps(header).encode('utf-8')
+        return ResultStore.magic + np.array([len(content)], dtype='<u8').tobytes() + content
+
+    @staticmethod
+    def _layout(header: dict) -> dict:
+        '''
+        Returns offsets of sections of the file.
+        '''
+        align = lambda offset: -(-offset // ResultStore.alignment)*ResultStore.alignment
+        offsets: dict = {}
+        offset = len(ResultStore._encodeHeader(header))
+        for name, size in (('nodeCoords', 16*header['nodesNumber']), ('connectivity', 32*header['elementsNumber']),
+                           ('bcMask', header['nodesNumber'])):
+            offsets[name] = offset = align(offset)
+            offset += size
+        offsets['records'] = align(offset)
+        return offsets
+
+    def append(self, time: float, temperatures: np.ndarray) -> None:
+        '''
+        Appends temperatures of a single step.
+        '''
+        if self._file is None:
+            self._file = open(self.filePath, mode='ab')
+        record = np.zeros(1, dtype=self._recordType)
+        temperatures = np.ravel(temperatures)
+        if len(temperatures) != self.header['nodesNumber']:
+            raise FiniteElementMethodException(f'Expected {self.header["nodesNumber"]} temperatures, got {len(temperatures)}.')
+        record['time'] = time
+        record['temperatures'] = temperatures
+        self._file.write(record.tobytes())
+        # records reach the file before a checkpoint of the same step can be saved
+        self._file.flush()
+        self._records = None
+
+    def writeFrame(self, temperatures: np.ndarray, time: float = None) -> str:
+        '''
+        Appends a step, so that the store can be used instead of a VTK writer. Returns path to the file.
+        '''
+        self.append(len(self) + 1 if time is None else time, temperatures)
+        return self.filePath
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _getRecords(self) -> np.ndarray:
+        '''
+        Returns memory-mapped records of all complete steps.
+        '''
+        if self._records is None:
+            self.flush()
+            steps = (os.path.getsize(self.filePath) - self._offsets['records']) // self._recordType.itemsize
+            if steps == 0:
+                return np.zeros(0, dtype=self._recordType)
+            self._records = np.memmap(self.filePath, dtype=self._recordType, mode='r', offset=self._offsets['records'], shape=(steps,))
+        return self._records
+
+    def _readArray(self, name: str, dtype: str, shape: tuple) -> np.memmap:
+        return np.memmap(self.filePath, dtype=dtype, mode='r', offset=self._offsets[name], shape=shape)
+
+    def __len__(self) -> int:
+        return len(self._getRecords())
+
+    @property
+    def times(self) -> np.ndarray:
+        return self._getRecords()['time']
+
+    @property
+    def temperatures(self) -> np.ndarray:
+        '''
+        Memory-mapped (steps, nodes) array of temperatures.
+        '''
+        return self._getRecords()['temperatures']
+
+    def frame(self, step: int) -> np.ndarray:
+        '''
+        Returns temperatures of all nodes in the step (numbered from 0).
+        '''
+        return np.array(self._getRecords()[step]['temperatures'])
+
+    def nodeHistory(self, node: int, steps: slice = slice(None)) -> np.ndarray:
+        '''
+        Returns temperatures of the node (index numbered from 0) in the given steps.
+        '''
+        return np.array(self.temperatures[steps, node])
+
+    def getNodeCoords(self) -> np.ndarray:
+        return self._readArray('nodeCoords', '<f8', (self.header['nodesNumber'], 2))
+
+    def getConnectivity(self) -> np.ndarray:
+        return self._readArray('connectivity', '<i8', (self.header['elementsNumber'], 4))
+
+    def getBcMask(self) -> np.ndarray:
+        return self._readArray('bcMask', 'u1', (self.header['nodesNumber'],)).astype(bool)
+
+    def createGrid(self) -> Grid:
+        '''
+        Returns grid of the stored mesh and global data (without local matrices).
+        '''
+        return Grid(GlobalData(self.header['globalData']), np.array(self.getNodeCoords()), np.array(self.getConnectivity()), self.getBcMask())
+
+    def exportVtk(self, destinationDir: str, steps=None, outputFormat: str = 'vtu') -> list[str]:
+        '''
+        Writes VTK frames of the chosen steps (slice, list of step numbers or None for all) and returns their paths.
+
+        outputFormat:   'vtu' (binary XML files with .pvd collection) or 'vtk' (ASCII files rendered from Jinja template)
+        '''
+        os.makedirs(destinationDir, exist_ok=True)
+        if outputFormat == 'vtu':
+            writer = VtuWriter(destinationDir, self.getNodeCoords(), self.getConnectivity(), dtype=self.header['dtype'])
+        elif outputFormat == 'vtk':
+            writer = VtkTemplateWriter(destinationDir, self.createGrid())
+        else:
+            raise FiniteElementMethodException(f'Unknown output format {outputFormat}, available formats: vtu, vtk.')
+        records = self._getRecords()
+        if steps is None:
+            indices = range(len(records))
+        elif isinstance(steps, slice):
+            indices = range(len(records))[steps]
+        else:
+            indices = steps
+        paths: list[str] = [writer.writeFrame(records[i]['temperatures'], float(records[i]['time'])) for i in indices]
+        writer.close()
+        return paths
@@ -1,7 +1,11 @@
 from common import *
 from grid import Grid
+from collections import OrderedDict
+from math import ceil
 import numpy as np
-from numpy import linalg
+from scipy import linalg, sparse
+from scipy.sparse.csgraph import reverse_cuthill_mckee
+from scipy.sparse.linalg import splu
 
 class SystemOfEquations:
     '''
@@ -10,41 +14,239 @@ class SystemOfEquations:
     H:      global matrix of H + Hbc od each element of the grid
     P:      global P vector
     C:      global C matrix
-    t0:     vector filled with value of initail temperature
+    t0:     vector filled with value of initail temperature, (dim, k) matrix with a column for every case
     step:   simulation step time
     dTau:   current time - start time
     dim:    dimensions of H matrix and P vector 
+    sparse: if True, H and C are stored as scipy CSR matrices and solved with a sparse direct solver
+    solver:             'direct' (factorization), 'pcg' (preconditioned conjugate gradient) or 'banded' (Cholesky factorization in banded storage)
+    preconditioner:     preconditioner used by pcg solver, 'jacobi' or 'ic' (incomplete Cholesky factorization without fill-in, IC(0))
+    tolerance:          pcg stops when the residual norm drops below tolerance * norm of the right-hand side,
+                        every step starts from the temperatures of the previous one
+    maxIterations:      maximum number of iterations of pcg solver in a single step
+    iterations:         number of pcg iterations in each solved step
+    instrumentation:    optional Instrumentation counting allocated global matrices and factorizations
+    factorizationCacheSize:     number of factorizations of H + C/step (for different steps) kept in LRU cache
+    lumped:             if True, C is replaced by diagonal matrix of its row sums (lumped mass)
+    CLumped:            diagonal of lumped C as (dim, 1) vector, None if C is not lumped
+    integrator:         'implicit' (backward Euler, linear system in every step) or 'explicit' (forward Euler with lumped C)
+    stableStep:         estimated largest stable step of explicit integrator, longer steps are split into equal substeps
+    matrices:           optional already assembled global (H + Hbc, C, P), used instead of assembling local matrices of the grid
+    initialTemps:       optional initial temperatures of k cases solved together, InitialTemp of the grid by default
+    tots:               optional ambient temperatures of k cases solved together, Tot of the grid by default
+    cases:              number of cases k, every case is a column of t0, P and results
+    reorder:            if True, nodes are renumbered with reverse Cuthill-McKee algorithm to reduce bandwidth of the matrices
+    permutation:        original node index of every row of the matrices (new -> old), None if nodes are not reordered
+    connectivity:       connectivity of elements used in assembly (renumbered if nodes are reordered)
+    bandwidth:          the biggest distance of a non-zero entry from the diagonal of H and C
+    assembly:           optional ParallelAssembly, global matrices are assembled from chunks of elements in its process pool
+
+    H + C/step is factorized once per step size and reused in every call of solve(), the least recently used
+    factorization is dropped when more than factorizationCacheSize step sizes were used.
+    PCG solver starts from the temperatures of the previous step.
+    Cases differ only in the right-hand side, so every step reuses the same factorization for all k columns.
+    Reordering is internal: t0, H, C and P are stored in the new order, results of solve() are returned in the original order.
+    Banded solver factorizes in O(dim * bandwidth^2) time, so it is usually combined with reordering.
     '''
-    def __init__(self, grid: Grid):
+    solvers: tuple[str] = ('direct', 'pcg', 'banded')
+    preconditioners: tuple[str] = ('jacobi', 'ic')
+    integrators: tuple[str] = ('implicit', 'explicit')
+
+    def __init__(self, grid: Grid, sparse: bool = False, solver: str = 'direct', preconditioner: str = 'jacobi',
+                 tolerance: float = 1e-6, maxIterations: int = 1000, instrumentation = None, factorizationCacheSize: int = 4,
+                 lumped: bool = False, integrator: str = 'implicit', matrices: tuple = None,
+                 initialTemps: list[float] = None, tots: list[float] = None, reorder: bool = False,
+                 assembly = None):
+        if solver not in SystemOfEquations.solvers:
+            raise FiniteElementMethodException(f'Unknown solver {solver}, available solvers: {", ".join(SystemOfEquations.solvers)}.')
+        # 'ilu' was the name of the incomplete factorization preconditioner before it was made symmetric
+        preconditioner = 'ic' if preconditioner == 'ilu' else preconditioner
+        if preconditioner not in SystemOfEquations.preconditioners:
+            raise FiniteElementMethodException(f'Unknown preconditioner {preconditioner}, available preconditioners: {", ".join(SystemOfEquations.preconditioners)}.')
+        if integrator not in SystemOfEquations.integrators:
+            raise FiniteElementMethodException(f'Unknown integrator {integrator}, available integrators: {", ".join(SystemOfEquations.integrators)}.')
+        if integrator == 'explicit' and solver == 'pcg':
+            raise FiniteElementMethodException('PCG solver cannot be used with the explicit integrator, which solves no linear systems.')
         self.dim: int = grid.globalData.nodesNumber
         self.t0: np.ndarray = np.full((self.dim, 1), grid.globalData.initialTemp)
         self.step: float = grid.globalData.simulationStepTime
         self.dTau: float = 0.0
-        self.H: np.ndarray = np.zeros((self.dim, self.dim))
+        self.sparse: bool = sparse
+        self.solver: str = solver
+        self.preconditioner: str = preconditioner
+        self.tolerance: float = tolerance
+        self.maxIterations: int = maxIterations
+        self.iterations: list[int] = []
+        self.instrumentation = instrumentation
         self.P: np.ndarray = np.zeros((self.dim, 1))
-        self.C: np.ndarray = np.zeros((self.dim, self.dim))
-        self._aggregateHAndC(grid)
-        self._aggreagteP(grid)
+        self.factorizationCacheSize: int = factorizationCacheSize
+        self._factorizations: OrderedDict = OrderedDict()
+        self._incompleteCholesky: IncompleteCholesky = None
+        self.integrator: str = integrator
+        self.lumped: bool = lumped or integrator == 'explicit'
+        self.CLumped: np.ndarray = None
+        self.stableStep: float = None
+        self.permutation: np.ndarray = None
+        self.connectivity: np.ndarray = grid.connectivity
+        if reorder:
+            self.permutation = SystemOfEquations.reverseCuthillMcKee(grid.connectivity, self.dim)
+            self._newIndices: np.ndarray = np.argsort(self.permutation)
+            self.connectivity = self._newIndices[grid.connectivity]
+        self.bandwidth: int = int(np.max(self.connectivity.max(axis=1) - self.connectivity.min(axis=1)))
+        self._matricesGiven: bool = matrices is not None
+        if matrices is not None:
+            self.H, self.C, self.P = matrices
+            if reorder:
+                self.H, self.C, self.P = (self._permute(matrix) for matrix in matrices)
+        elif assembly is not None:
+            self.H, self.C, self.P = assembly.assemble(grid, self.connectivity)
+            if not sparse:
+                self.H, self.C = self.H.toarray(), self.C.toarray()
+        elif sparse:
+            self._aggregateSparse(grid)
+        else:
+            self.H: np.ndarray = np.zeros((self.dim, self.dim))
+            self.C: np.ndarray = np.zeros((self.dim, self.dim))
+            self._aggregateHAndC(grid)
+            self._aggreagteP(grid)
+        if instrumentation is not None:
+            instrumentation.count('globalMatrices', 2)
+        self.cases: int = 1
+        if initialTemps is not None or tots is not None:
+            self._setCases(grid, initialTemps, tots)
+        if self.lumped:
+            self._lumpC()
+        if integrator == 'explicit':
+            self.stableStep = SystemOfEquations.estimateStableStep(grid)
+
+    def _setCases(self, grid: Grid, initialTemps: list[float], tots: list[float]) -> None:
+        '''
+        Replaces t0 and P with (dim, k) matrices of k cases.
+        P is linear in Tot: P = Tot * b, where b = alfa * integral of N over the boundary. Shape functions sum up to 1,
+        so b is assembled from row sums of local Hbc matrices, or, for given matrices, P is rescaled by Tot.
+        '''
+        lengths = {len(values) for values in (initialTemps, tots) if values is not None}
+        if len(lengths) > 1:
+            raise FiniteElementMethodException('initialTemps and tots must have the same number of cases.')
+        self.cases = lengths.pop()
+        if self.cases < 1:
+            raise FiniteElementMethodException('At least one case is required.')
+        initialTemps = np.full(self.cases, grid.globalData.initialTemp) if initialTemps is None else initialTemps
+        self.t0 = np.tile(np.asarray(initialTemps, dtype=float), (self.dim, 1))
+        if tots is None:
+            self.P = np.tile(self.P, (1, self.cases))
+            return
+        if self._matricesGiven:
+            if grid.globalData.tot == 0:
+                raise FiniteElementMethodException('Tot of the grid must be non-zero to rescale given P for different tots.')
+            boundaryVector = self.P/grid.globalData.tot
+        else:
+            boundaryVector = SystemOfEquations.assembleVector(self.connectivity, grid.Hbc.sum(axis=2), self.dim)
+        self.P = boundaryVector*np.asarray(tots, dtype=float)
+
+    @staticmethod
+    def reverseCuthillMcKee(connectivity: np.ndarray, nodesNumber: int) -> np.ndarray:
+        '''
+        Returns reverse Cuthill-McKee ordering of nodes (new -> old index) computed from the graph of nodes sharing an element.
+        '''
+        rows = np.repeat(connectivity, 4, axis=1).ravel()
+        cols = np.tile(connectivity, (1, 4)).ravel()
+        graph = sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(nodesNumber, nodesNumber)).tocsr()
+        return reverse_cuthill_mckee(graph, symmetric_mode=True).astype(np.int64)
+
+    def _permute(self, matrix):
+        '''
+        Returns matrix or vector in the original node order reordered to the new order.
+        '''
+        if matrix.ndim == 2 and matrix.shape[1] == self.dim:
+            return matrix[self.permutation][:, self.permutation]
+        return matrix[self.permutation]
+
+    def _toOriginalOrder(self, temperatures: np.ndarray) -> np.ndarray:
+        '''
+        Returns temperatures in the original node order.
+        '''
+        return temperatures if self.permutation is None else temperatures[self._newIndices]
+
+    def getState(self) -> dict:
+        '''
+        Returns state needed to continue the simulation: temperatures (in the original node order), time and step size.
+        '''
+        return {'temperatures': self._toOriginalOrder(self.t0), 'time': self.dTau, 'step': self.step}
+
+    def setState(self, state: dict) -> None:
+        '''
+        Restores state returned by getState.
+        '''
+        temperatures = np.asarray(state['temperatures'], dtype=float).reshape(self.dim, -1)
+        if temperatures.shape[1] != self.cases:
+            raise FiniteElementMethodException(f'Expected temperatures of {self.cases} cases, got {temperatures.shape[1]}.')
+        self.t0 = temperatures if self.permutation is None else temperatures[self.permutation]
+        self.dTau = float(state['time'])
+        self.step = float(state['step'])
+
+    def _lumpC(self) -> None:
+        '''
+        Replaces C with diagonal matrix of its row sums.
+        '''
+        self.CLumped = np.asarray(self.C.sum(axis=1), dtype=float).reshape(-1, 1)
+        if self.sparse:
+            self.C = sparse.diags(self.CLumped.ravel(), format='csr')
+        else:
+            self.C = np.diag(self.CLumped.ravel())
+
+    @staticmethod
+    def estimateStableStep(grid: Grid, safety: float = 0.9) -> float:
+        '''
+        Estimates the largest stable step of forward Euler method with lumped C from local matrices of elements.
+        The biggest eigenvalue of C^-1 * H is bounded by the biggest eigenvalue over elements, which is bounded
+        by Gershgorin circles: max_i(sum_j |H_ij| / C_ii). Forward Euler is stable for step < 2/eigenvalue.
+        '''
+        H, C, Hbc, _ = grid.getLocalMatrices()
+        eigenvalueBound = float(np.max(np.abs(H + Hbc).sum(axis=2)/C.sum(axis=2)))
+        return safety*2/eigenvalueBound
+
+    def _aggregateSparse(self, grid: Grid) -> None:
+        '''
+        Creates global H and C matrices in CSR format and global P vector.
+        COO triplets of all elements are built at once, duplicated entries are summed during conversion.
+        '''
+        H, C, Hbc, P = grid.getLocalMatrices()
+        self.H = SystemOfEquations.assembleSparse(self.connectivity, H + Hbc, self.dim)
+        self.C = SystemOfEquations.assembleSparse(self.connectivity, C, self.dim)
+        self.P = SystemOfEquations.assembleVector(self.connectivity, P, self.dim)
+
+    @staticmethod
+    def assembleSparse(connectivity: np.ndarray, local: np.ndarray, dim: int) -> sparse.csr_matrix:
+        '''
+        Creates global CSR matrix from (E, 4, 4) local matrices.
+        '''
+        rows = np.repeat(connectivity, 4, axis=1).ravel()
+        cols = np.tile(connectivity, (1, 4)).ravel()
+        return sparse.coo_matrix((local.ravel(), (rows, cols)), shape=(dim, dim)).tocsr()
+
+    @staticmethod
+    def assembleVector(connectivity: np.ndarray, local: np.ndarray, dim: int) -> np.ndarray:
+        '''
+        Creates global (dim, 1) vector from (E, 4) local vectors.
+        '''
+        return np.bincount(connectivity.ravel(), weights=local.ravel(), minlength=dim).reshape(-1, 1)
 
     def _aggregateHAndC(self, grid: Grid) -> None:
         '''
         Creates global H and C matrices.
         '''
-        for element in grid.elements:
-            localH = element.H + element.Hbc
-            for j in range(0, 4):
-                for i in range(0, 4):
-                    self.H[element.nodeIds[j] - 1][element.nodeIds[i] - 1] += localH[j][i]
-                    self.C[element.nodeIds[j] - 1][element.nodeIds[i] - 1] += element.C[j][i]
+        rows = self.connectivity[:, :, None]
+        cols = self.connectivity[:, None, :]
+        np.add.at(self.H, (rows, cols), grid.H + grid.Hbc)
+        np.add.at(self.C, (rows, cols), grid.C)
         #print(f"Global H:\n{self.H}\nGlobal C:{self.C}")
 
     def _aggreagteP(self, grid: Grid) -> None:
         '''
         Creates global P vector from local (per element) P vectors.
         '''
-        for element in grid.elements:
-            for i in range(0, 4):
-                self.P[element.nodeIds[i] - 1] += element.P[i]
+        np.add.at(self.P[:, 0], self.connectivity, grid.P)
         #print(f"Global P:\n{self.P}")
 
     def solve(self) -> np.ndarray:
@@ -57,8 +259,330 @@ class SystemOfEquations:
         H[n] + C[n]/dTau * t1[n] = C[n]/dTau * t0[n] + P[n]
         '''
         self.dTau += self.step
-        H = self.H + self.C/(self.step)
-        P = self.P + np.matmul(self.C/(self.step), self.t0)
-        result: np.ndarray = linalg.solve(H, P)
-        self.t0 = result
-        return result
\ No newline at end of file
+        self.t0 = self._advance(self.t0, self.step)
+        return self._toOriginalOrder(self.t0)
+
+    def solveAdaptive(self, controller: 'AdaptiveStepController', endTime: float = None) -> np.ndarray:
+        '''
+        Solves a single time step with the step size chosen by the controller. Local error is estimated by step doubling:
+        the difference between one step of size step and two steps of size step/2. Rejected steps are repeated with a smaller step.
+        The solution of two half steps is accepted, self.step is set to the size proposed for the next step.
+
+        endTime:    if given, the step is shortened so that it does not exceed endTime
+        '''
+        self.step = controller.clamp(self.step)
+        while True:
+            step = self.step if endTime is None else min(self.step, endTime - self.dTau)
+            full = self._advance(self.t0, step)
+            half = self._advance(self._advance(self.t0, step/2), step/2)
+            error = float(np.max(np.abs(half - full)))
+            accepted, self.step = controller.nextStep(self.step, error)
+            if accepted:
+                self.dTau += step
+                self.t0 = half
+                return self._toOriginalOrder(half)
+
+    def _advance(self, t0: np.ndarray, step: float) -> np.ndarray:
+        '''
+        Returns temperatures after a single step of the given size, starting from t0.
+        '''
+        if self.integrator == 'explicit':
+            return self._advanceExplicit(t0, step)
+        CStep, factorization = self._getFactorization(step)
+        P = self.P + CStep @ t0
+        return self._solveFactorized(P, factorization, t0)
+
+    def _advanceExplicit(self, t0: np.ndarray, step: float) -> np.ndarray:
+        '''
+        Returns temperatures after the step calculated with forward Euler method:
+        t1 = t0 + dt * (P - H*t0) / CLumped
+        The step is split into equal substeps not longer than stableStep.
+        '''
+        substeps = max(1, ceil(step/self.stableStep))
+        dt = step/substeps
+        t = t0.astype(float)
+        for _ in range(substeps):
+            t = t + dt*(self.P - self.H @ t)/self.CLumped
+        return t
+
+    def _getFactorization(self, step: float) -> tuple:
+        '''
+        Returns C/step and factorization of H + C/step from LRU cache, calculates them if step is not cached.
+        Dense matrix is factorized with Cholesky decomposition (LU if it is not positive definite), sparse one with SuperLU.
+        Banded solver factorizes upper band of the matrix with Cholesky decomposition (LU if it is not positive definite).
+        For pcg solver only the preconditioner is calculated.
+        '''
+        if step in self._factorizations:
+            self._factorizations.move_to_end(step)
+            return self._factorizations[step]
+        CStep = self.C/step
+        H = self.H + CStep
+        if self.instrumentation is not None:
+            self.instrumentation.count('globalMatrices', 2)
+            self.instrumentation.count('factorizations')
+        if self.solver == 'pcg':
+            factorization = ('pcg', (H, self._createPreconditioner(H)))
+        elif self.solver == 'banded':
+            factorization = self._factorizeBanded(H)
+        elif self.sparse:
+            factorization = ('superlu', splu(sparse.csc_matrix(H)))
+        else:
+            try:
+                factorization = ('cholesky', linalg.cho_factor(H))
+            except linalg.LinAlgError:
+                factorization = ('lu', linalg.lu_factor(H))
+        self._factorizations[step] = (CStep, factorization)
+        if len(self._factorizations) > self.factorizationCacheSize:
+            self._factorizations.popitem(last=False)
+        return CStep, factorization
+
+    def _factorizeBanded(self, H) -> tuple:
+        '''
+        Returns Cholesky factorization of symmetric H stored as upper band (bandwidth + 1, dim),
+        or the full band (2*bandwidth + 1, dim) for LU solver if H is not positive definite.
+        '''
+        upper = sparse.triu(sparse.coo_matrix(H)).tocoo()
+        band = np.zeros((self.bandwidth + 1, self.dim))
+        band[self.bandwidth + upper.row - upper.col, upper.col] = upper.data
+        try:
+            return ('choleskyBanded', linalg.cholesky_banded(band))
+        except linalg.LinAlgError:
+            full = sparse.coo_matrix(H)
+            band = np.zeros((2*self.bandwidth + 1, self.dim))
+            band[self.bandwidth + full.row - full.col, full.col] = full.data
+            return ('luBanded', band)
+
+    def _solveFactorized(self, P: np.ndarray, factorization: tuple, t0: np.ndarray) -> np.ndarray:
+        '''
+        Solves (H + C/step) * t1 = P using factorization returned by _getFactorization, pcg solver starts from t0.
+        All columns (cases) of P are solved with a single call of the triangular solver.
+        '''
+        method, factors = factorization
+        if method == 'pcg':
+            # cases are solved one by one, the biggest number of iterations is recorded
+            results, iterations = zip(*(self._pcg(*factors, P[:, i], t0[:, i]) for i in range(P.shape[1])))
+            self.iterations.append(max(iterations))
+            return np.column_stack(results)
+        if method == 'superlu':
+            return factors.solve(P).reshape(P.shape)
+        if method == 'choleskyBanded':
+            return linalg.cho_solve_banded((factors, False), P)
+        if method == 'luBanded':
+            return linalg.solve_banded((self.bandwidth, self.bandwidth), factors, P)
+        if method == 'cholesky':
+            return linalg.cho_solve(factors, P)
+        return linalg.lu_solve(factors, P)
+
+    def _createPreconditioner(self, H):
+        '''
+        Returns function applying inverse of the preconditioner to a vector.
+        Both preconditioners are symmetric positive definite, as required by conjugate gradient method.
+        For IC(0) M = L * L^T, so M^-1 * r = L^-T * L^-1 * r, triangular solves are done by SuperLU (L is factorized
+        without reordering and pivoting, so its factors have no fill-in).
+        '''
+        if self.preconditioner == 'ic':
+            # symbolic analysis is shared by matrices of all step sizes
+            if self._incompleteCholesky is None or not self._incompleteCholesky.matches(H):
+                self._incompleteCholesky = IncompleteCholesky(H)
+            factor = splu(sparse.csc_matrix(self._incompleteCholesky.factorize(H)), permc_spec='NATURAL',
+                          diag_pivot_thresh=0, options={'SymmetricMode': True})
+            return lambda r: factor.solve(factor.solve(r), trans='T')
+        inverseDiagonal = 1/H.diagonal()
+        return lambda r: inverseDiagonal*r
+
+    @staticmethod
+    def incompleteCholesky(H, shift: float = 1e-3) -> sparse.csr_matrix:
+        '''
+        Returns lower triangular factor L of incomplete Cholesky factorization H ~ L * L^T with the sparsity pattern of H (IC(0)),
+        see IncompleteCholesky.
+        '''
+        return IncompleteCholesky(H).factorize(H, shift)
+
+    def _pcg(self, H, applyPreconditioner, P: np.ndarray, t: np.ndarray) -> tuple:
+        '''
+        Solves H * t1 = P with preconditioned conjugate gradient method, starting from t.
+        Returns solution and number of iterations.
+        '''
+        t = t.astype(float)
+        r = P - H @ t
+        stopNorm = self.tolerance*(np.linalg.norm(P) or 1.0)
+        if np.linalg.norm(r) <= stopNorm:
+            return t, 0
+        z = applyPreconditioner(r)
+        p = z.copy()
+        rz = np.dot(r, z)
+        for iteration in range(1, self.maxIterations + 1):
+            Hp = H @ p
+            alpha = rz/np.dot(p, Hp)
+            t += alpha*p
+            r -= alpha*Hp
+            if np.linalg.norm(r) <= stopNorm:
+                return t, iteration
+            z = applyPreconditioner(r)
+            rzNew = np.dot(r, z)
+            p = z + (rzNew/rz)*p
+            rz = rzNew
+        raise FiniteElementMethodException(f'PCG solver did not converge in {self.maxIterations} iterations (residual {np.linalg.norm(r)}).')
+
+class IncompleteCholesky:
+    '''
+    Incomplete Cholesky factorization H ~ L * L^T with the sparsity pattern of lower triangle of H (IC(0)).
+
+    L[i, k] = (H[i, k] - sum_j<k L[i, j]*L[k, j]) / L[k, k]
+    L[i, i] = sqrt(H[i, i] - sum_j<i L[i, j]^2)
+
+    Symbolic analysis (done once per pattern, so that matrices of all step sizes share it) lists the products L[i, j]*L[k, j]
+    of every entry and schedules rows in levels: rows of a level depend only on rows of earlier levels.
+    Numeric factorization then calculates entries at the same position of all rows of a level at once,
+    so the number of vectorized updates is number of levels * row length instead of number of entries.
+
+    indptr, indices:    CSR pattern of lower triangle of H (sorted, diagonal is the last entry of every row)
+    '''
+    def __init__(self, H):
+        lower = IncompleteCholesky._lower(H)
+        self.indptr: np.ndarray = lower.indptr
+        self.indices: np.ndarray = lower.indices
+        dim = lower.shape[0]
+        rowLengths = np.diff(self.indptr)
+        rows = np.repeat(np.arange(dim), rowLengths)
+        self._diagonal: np.ndarray = self.indptr[1:] - 1
+        if np.any(self.indices[self._diagonal] != np.arange(dim)):
+            raise FiniteElementMethodException('Incomplete Cholesky factorization requires all diagonal entries of the matrix.')
+        self._isDiagonal: np.ndarray = self.indices == rows
+        self._diagonalOfColumn: np.ndarray = self._diagonal[self.indices]
+
+        # strict lower entries grouped by column (CSC order), every pair of them in a column j gives the product
+        # L[i, j]*L[k, j] of entry (i, k), every single one gives L[i, j]^2 of diagonal entry (i, i)
+        strict = np.flatnonzero(~self._isDiagonal)
+        byColumn = strict[np.lexsort((rows[strict], self.indices[strict]))]
+        columnStarts = np.searchsorted(self.indices[byColumn], np.arange(dim + 1))
+        positions = np.arange(len(byColumn)) - columnStarts[self.indices[byColumn]]
+        first = np.repeat(np.arange(len(byColumn)), positions)
+        second = columnStarts[self.indices[byColumn[first]]] + np.arange(len(first)) - np.repeat(np.cumsum(positions) - positions, positions)
+        entryI, entryK = byColumn[first], byColumn[second]
+        keys = rows*dim + self.indices
+        pairKeys = rows[entryI]*dim + rows[entryK]
+        targets = np.minimum(np.searchsorted(keys, pairKeys), len(keys) - 1)
+        inPattern = keys[targets] == pairKeys
+        targets = np.concatenate((targets[inPattern], self._diagonal[rows[strict]]))
+        factorsA = np.concatenate((entryI[inPattern], strict))
+        factorsB = np.concatenate((entryK[inPattern], strict))
+
+        # entry groups: (level of its row, position in its row), groups are processed in increasing order
+        groupKeys = IncompleteCholesky._rowLevels(self.indptr, byColumn, rows, columnStarts)[rows]*rowLengths.max() \
+            + np.arange(len(rows)) - self.indptr[rows]
+        self._entries: np.ndarray = np.argsort(groupKeys, kind='stable')
+        groupKeys = groupKeys[self._entries]
+        self._groupStarts: np.ndarray = np.flatnonzero(np.r_[True, groupKeys[1:] != groupKeys[:-1], True])
+        entryGroups = np.empty(len(rows), dtype=np.int64)
+        entryGroups[self._entries] = np.repeat(np.arange(len(self._groupStarts) - 1), np.diff(self._groupStarts))
+        entryPositions = np.empty(len(rows), dtype=np.int64)
+        entryPositions[self._entries] = np.arange(len(rows))
+        order = np.argsort(entryGroups[targets], kind='stable')
+        self._factorsA: np.ndarray = factorsA[order]
+        self._factorsB: np.ndarray = factorsB[order]
+        self._localTargets: np.ndarray = (entryPositions - self._groupStarts[entryGroups])[targets[order]]
+        self._productStarts: np.ndarray = np.searchsorted(entryGroups[targets[order]], np.arange(len(self._groupStarts)))
+
+    @staticmethod
+    def _lower(H) -> sparse.csr_matrix:
+        lower = sparse.tril(sparse.csr_matrix(H), format='csr')
+        lower.sum_duplicates()
+        lower.sort_indices()
+        return lower
+
+    @staticmethod
+    def _rowLevels(indptr: np.ndarray, byColumn: np.ndarray, rows: np.ndarray, columnStarts: np.ndarray) -> np.ndarray:
+        '''
+        Returns level of every row: 0 for rows without strict lower entries, otherwise 1 + the highest level of rows
+        they depend on (columns of their strict lower entries). Rows are released level by level (Kahn's algorithm).
+        '''
+        remaining = np.diff(indptr) - 1
+        levels = np.zeros(len(remaining), dtype=np.int64)
+        dependents = rows[byColumn]
+        frontier = np.flatnonzero(remaining == 0)
+        level = 0
+        while len(frontier):
+            levels[frontier] = level
+            starts, stops = columnStarts[frontier], columnStarts[frontier + 1]
+            lengths = stops - starts
+            released = dependents[np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())]
+            released, counts = np.unique(released, return_counts=True)
+            remaining[released] -= counts
+            frontier = released[remaining[released] == 0]
+            level += 1
+        return levels
+
+    def matches(self, H) -> bool:
+        '''
+        Returns True if lower triangle of H has the analysed pattern.
+        '''
+        lower = IncompleteCholesky._lower(H)
+        return np.array_equal(lower.indptr, self.indptr) and np.array_equal(lower.indices, self.indices)
+
+    def factorize(self, H, shift: float = 1e-3) -> sparse.csr_matrix:
+        '''
+        Returns lower triangular factor L (CSR) of H with the analysed pattern.
+        If a non-positive pivot occurs, the factorization is repeated for H + shift*diag(H) with shift doubled each time.
+        '''
+        lower = IncompleteCholesky._lower(H)
+        appliedShift = 0.0
+        while True:
+            values = lower.data.astype(float)
+            values[self._diagonal] *= 1 + appliedShift
+            factor = self._factorizeValues(values)
+            if factor is not None:
+                return sparse.csr_matrix((factor, self.indices, self.indptr), shape=lower.shape)
+            appliedShift = shift if appliedShift == 0 else 2*appliedShift
+
+    def _factorizeValues(self, values: np.ndarray) -> np.ndarray:
+        '''
+        Returns values of L, or None if a non-positive pivot occurs.
+        '''
+        factor = np.zeros(len(values))
+        for group in range(len(self._groupStarts) - 1):
+            entries = self._entries[self._groupStarts[group]:self._groupStarts[group + 1]]
+            products = slice(self._productStarts[group], self._productStarts[group + 1])
+            value = values[entries] - np.bincount(self._localTargets[products], minlength=len(entries),
+                                                  weights=factor[self._factorsA[products]]*factor[self._factorsB[products]])
+            isDiagonal = self._isDiagonal[entries]
+            if np.any(value[isDiagonal] <= 0):
+                return None
+            divisor = factor[self._diagonalOfColumn[entries]]
+            divisor[isDiagonal] = 1
+            factor[entries] = np.where(isDiagonal, np.sqrt(np.abs(value)), value/divisor)
+        return factor
+
+class AdaptiveStepController:
+    '''
+    Chooses step size for SystemOfEquations.solveAdaptive from the estimated local error.
+    Steps are halved or doubled (and clamped to the bounds), so that the few step sizes in use hit the factorization cache.
+
+    errorTolerance:     maximum accepted local error (max difference of temperatures in nodes)
+    minStep:            the smallest allowed step, only steps of this size are accepted with error above errorTolerance
+    maxStep:            the biggest allowed step
+    '''
+    def __init__(self, errorTolerance: float, minStep: float, maxStep: float):
+        if not 0 < minStep <= maxStep:
+            raise FiniteElementMethodException('Step bounds must satisfy 0 < minStep <= maxStep.')
+        self.errorTolerance: float = errorTolerance
+        self.minStep: float = minStep
+        self.maxStep: float = maxStep
+
+    def clamp(self, step: float) -> float:
+        '''
+        Returns step limited to [minStep, maxStep].
+        '''
+        return min(max(step, self.minStep), self.maxStep)
+
+    def nextStep(self, step: float, error: float) -> tuple:
+        '''
+        Returns (True if the step is accepted, size of the next step).
+        Local error of implicit Euler method grows with step^2, so the step is doubled only if error < errorTolerance/4.
+        '''
+        step = self.clamp(step)
+        if error > self.errorTolerance and step > self.minStep:
+            return False, max(step/2, self.minStep)
+        if error < self.errorTolerance/4 and step < self.maxStep:
+            return True, min(step*2, self.maxStep)
+        return True, step
@@ -1,75 +1,314 @@
 from common import *
-from grid import Grid, Element, Node
-from jinja2 import Template
-from local_matrices_calculation import LocalMatricesCalculation
-from system_of_equations import SystemOfEquations
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
+from collections.abc import Callable, Iterable, Iterator
+from checkpoint import Checkpoint, CheckpointWriter
+from grid import Grid
+from instrumentation import Instrumentation
+from local_matrices_calculation import LocalMatricesCalculation, ElementMatricesCache
+from parallel_assembly import ParallelAssembly
+from system_of_equations import SystemOfEquations, AdaptiveStepController
+from result_store import ResultStore
+from vtk_writer import VtuWriter, VtkTemplateWriter
+from time import perf_counter
+import argparse
 import numpy as np
 
 def getInputFilePath() -> str:
     '''
-    Gets path to grid file from user.
+    Gets path to grid file from user. Tkinter is imported only here, so that headless runs do not need it.
     '''
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
     Tk().withdraw()
     inputFilePath: str = askopenfilename()
     return inputFilePath
 
-def simulate(grid: Grid) -> list[np.ndarray]:
+def simulateSteps(grid: Grid, instrumentation: Instrumentation = None, adaptive: AdaptiveStepController = None,
+                  withTime: bool = False, checkpointWriter: CheckpointWriter = None, restart: Checkpoint = None,
+                  assembly: ParallelAssembly = None, **solverOptions) -> Iterator[np.ndarray]:
     '''
-    Returns temeratures in element nodes for all time steps.
+    Yields temeratures in element nodes for every time step, only the current state is kept in memory.
+
+    instrumentation:    optional Instrumentation recording global assembly time and every solved step
+    adaptive:           if given, step size is chosen by the controller instead of fixed SimulationStepTime
+    withTime:           if True, (time, temperatures) tuples are yielded
+    checkpointWriter:   optional CheckpointWriter, called after the consumer has processed every step and at the end
+    restart:            optional Checkpoint to continue from, only the steps after it are yielded
+    assembly:           optional ParallelAssembly used to assemble global matrices
+    solverOptions:      keyword arguments passed to SystemOfEquations (sparse, solver, preconditioner, tolerance, maxIterations, lumped, integrator, initialTemps, tots, reorder)
     '''
-    temperatures: list[np.ndarray] = []
-    soe = SystemOfEquations(grid)
+    instrumentation = instrumentation or Instrumentation()
+    with instrumentation.phase('globalAssembly'):
+        soe = SystemOfEquations(grid, instrumentation=instrumentation, assembly=assembly, **solverOptions)
     tau0: int = 0
+    stepsNumber: int = 0
+    if restart is not None:
+        restart.checkGrid(grid)
+        soe.setState({'temperatures': restart.temperatures, 'time': restart.time, 'step': restart.step})
+        tau0, stepsNumber = restart.tau0, restart.stepsNumber
     tauK: float = grid.globalData.simulationTime
     step: float = grid.globalData.simulationStepTime
-    print(f'Time        Min temp    Max temp')
-    while tau0 < tauK:
-        result: np.ndarray = soe.solve()
-        temperatures.append(result)
-        print(f'{(soe.dTau):<12}{round(min(result)[0], 3):<12}{round(max(result)[0], 3):<12}')
+    iterative: bool = soe.solver == 'pcg'
+    print(f'Time        Min temp    Max temp{"    Iterations" if iterative else ""}')
+    while (soe.dTau if adaptive else tau0) < tauK:
+        with instrumentation.phase('solve'):
+            start = perf_counter()
+            result: np.ndarray = soe.solve() if adaptive is None else soe.solveAdaptive(adaptive, tauK)
+            solveTime = perf_counter() - start
+        instrumentation.recordStep(soe.dTau, solveTime, result, soe.iterations[-1] if iterative else None)
+        print(f'{round(soe.dTau, 6):<12}{round(float(result.min()), 3):<12}{round(float(result.max()), 3):<12}{soe.iterations[-1] if iterative else ""}')
+        yield (soe.dTau, result) if withTime else result
         tau0+=step
+        stepsNumber += 1
+        if checkpointWriter is not None:
+            checkpointWriter.update(grid, soe, tau0, stepsNumber, solverOptions)
+    if checkpointWriter is not None:
+        checkpointWriter.update(grid, soe, tau0, stepsNumber, solverOptions, force=True)
     print('')
-    return temperatures
 
-def generateVtkFiles(inputFilename: str, grid: Grid, temperatures: list[np.ndarray]) -> None:
+def simulate(grid: Grid, sink: Callable[[np.ndarray], None] = None, instrumentation: Instrumentation = None, **solverOptions) -> list[np.ndarray]:
+    '''
+    Returns temeratures in element nodes for all time steps.
+    If sink is given, it is called with temperatures of every step as soon as they are calculated and nothing is returned.
+
+    instrumentation:    optional Instrumentation recording global assembly time and every solved step
+    solverOptions:      keyword arguments passed to SystemOfEquations (sparse, solver, preconditioner, tolerance, maxIterations, lumped, integrator, initialTemps, tots, reorder)
+    '''
+    if sink is None:
+        return list(simulateSteps(grid, instrumentation, **solverOptions))
+    for result in simulateSteps(grid, instrumentation, **solverOptions):
+        sink(result)
+
+def simulateCases(grid: Grid, initialTemps: list[float] = None, tots: list[float] = None, instrumentation: Instrumentation = None,
+                  **solverOptions) -> list[list[np.ndarray]]:
+    '''
+    Simulates k cases differing only in initial temperature and/or ambient temperature (Tot) together,
+    every step solves all of them with a single factorization. Returns temperatures of all time steps for every case.
+    '''
+    results = simulate(grid, instrumentation=instrumentation, initialTemps=initialTemps, tots=tots, **solverOptions)
+    cases: int = results[0].shape[1] if results else 0
+    return [[result[:, [i]] for result in results] for i in range(cases)]
+
+class FrameSelector:
+    '''
+    Decides which time steps are written to output files.
+
+    every:      every k-th step is written (k, 2k, 3k, ...)
+    times:      if given, only the first step reaching each of these times is written (every is ignored)
+    tolerance:  steps earlier than the requested time by less than tolerance count as reaching it
+    '''
+    def __init__(self, every: int = 1, times: list[float] = None, tolerance: float = 1e-9):
+        if every < 1:
+            raise FiniteElementMethodException('Frame interval (every) must be a positive integer.')
+        self.every: int = every
+        self.times: list[float] = None if times is None else sorted(times)
+        self.tolerance: float = tolerance
+        self._nextTime: int = 0
+
+    def skipUntil(self, time: float) -> None:
+        '''
+        Marks requested times reached before the given time as already written (i.e. when a run is restarted).
+        '''
+        while self.times is not None and self._nextTime < len(self.times) and time >= self.times[self._nextTime] - self.tolerance:
+            self._nextTime += 1
+
+    def isSelected(self, stepNumber: int, time: float) -> bool:
+        '''
+        Returns True if the step (numbered from 1) at the given time should be written.
+        '''
+        if self.times is None:
+            return stepNumber % self.every == 0
+        selected: bool = False
+        while self._nextTime < len(self.times) and time >= self.times[self._nextTime] - self.tolerance:
+            selected = True
+            self._nextTime += 1
+        return selected
+
+def createVtkWriter(inputFilename: str, grid: Grid, outputFormat: str = 'vtu', outputDir: str = outputPath, resumeTime: float = None):
+    '''
+    Clears output directory and returns writer of frames.
+    If resumeTime is given (restarted run), the existing store is truncated to steps up to resumeTime and appended to.
+
+    outputFormat:   'vtu' (binary XML files with .pvd collection), 'vtk' (ASCII files rendered from Jinja template)
+                    or 'store' (all steps in a single results.femres file, see ResultStore)
+    outputDir:      directory in which the directory named after the input file is created
+    '''
+    if resumeTime is not None:
+        if outputFormat != 'store':
+            raise FiniteElementMethodException('Restarted run can only append to the store output format.')
+        filePath = os.path.join(outputDir, os.path.basename(inputFilename).split('.')[0], 'results.femres')
+        if os.path.isfile(filePath):
+            return ResultStore.resume(filePath, resumeTime)
+    destinationDir: str = createOrClearDirectory(inputFilename, outputDir)
+    if outputFormat == 'store':
+        return ResultStore.create(os.path.join(destinationDir, 'results.femres'), grid)
+    if outputFormat == 'vtu':
+        return VtuWriter(destinationDir, grid.getNodeCoords(), grid.getConnectivity())
+    if outputFormat == 'vtk':
+        return VtkTemplateWriter(destinationDir, grid)
+    raise FiniteElementMethodException(f'Unknown output format {outputFormat}, available formats: vtu, vtk, store.')
+
+def generateVtkFiles(inputFilename: str, grid: Grid, temperatures: Iterable[np.ndarray], outputFormat: str = 'vtu',
+                     instrumentation: Instrumentation = None, outputDir: str = outputPath, frameSelector: FrameSelector = None,
+                     restart: Checkpoint = None) -> None:
     '''
     Creates files for simulation in ParaView environment.
+    Temperatures can be a generator (see simulateSteps), every frame is written as soon as it is produced.
+    Items are temperature arrays of consecutive fixed steps or (time, temperatures) tuples.
+
+    frameSelector:  optional FrameSelector, steps it does not select are simulated but not written
+    restart:        Checkpoint the temperatures continue from, steps are numbered after it and the store is appended to
+    '''
+    instrumentation = instrumentation or Instrumentation()
+    frameSelector = frameSelector or FrameSelector()
+    stepsOffset: int = 0
+    if restart is not None:
+        frameSelector.skipUntil(restart.time)
+        stepsOffset = restart.stepsNumber
+    with instrumentation.phase('outputWriting'):
+        writer = createVtkWriter(inputFilename, grid, outputFormat, outputDir, None if restart is None else restart.time)
+    step: float = grid.globalData.simulationStepTime
+    for i, stepTemperatures in enumerate(temperatures, start=stepsOffset):
+        time, stepTemperatures = stepTemperatures if isinstance(stepTemperatures, tuple) else ((i + 1)*step, stepTemperatures)
+        if not frameSelector.isSelected(i + 1, time):
+            continue
+        with instrumentation.phase('outputWriting'):
+            writer.writeFrame(stepTemperatures, time)
+    with instrumentation.phase('outputWriting'):
+        writer.close()
+    print(f'Output files generated in {writer.destinationDir}')
+
+def getLocalMatricesFilePath(checkpointFilePath: str) -> str:
     '''
-    numOfFiles: int = len(temperatures)
-    elementNodesNumber: int = []
-    for element in grid.elements:
-        elementNodesNumber.append(len(element.nodeIds))
-
-    data: dict = {}
-    data['nodesNumber']: int = grid.globalData.nodesNumber
-    data['nodes']: list[Node] = grid.nodes
-    data['elementsNumber']: int = grid.globalData.elementsNumber
-    data['elements']: list[Element] = grid.elements
-    data['elementNodesNumber']: int = elementNodesNumber
-    data['sumOfElementsData']: int = grid.globalData.elementsNumber + sum(elementNodesNumber)
-    
-    destinationDir: str = createOrClearDirectory(inputFilename)
-    template: Template = initializeJinjaEnvironment('temperatures.vtk.jinja')
-    for i in range(0, numOfFiles):
-        data['temperatures']: np.ndarray = temperatures[i]
-        filename: str = f'frame{i+1}.vtk'
-        generateFile(data, template, destinationDir, filename)
-    print(f'Output files generated in {destinationDir}')
-
-def run() -> None:
+    Returns path of local matrices cached next to the checkpoint file, i.e. run.localMatrices.npz for run.npz.
+    '''
+    return f'{os.path.splitext(checkpointFilePath)[0]}.localMatrices.npz'
+
+def run(instrumentation: Instrumentation = None, inputFilePath: str = None, order: int = 5, outputDir: str = outputPath,
+        outputFormat: str = 'vtu', frameSelector: FrameSelector = None, reportFilePath: str = None, checkpointFilePath: str = None,
+        checkpointEverySteps: int = None, checkpointEverySeconds: float = None, restart: bool = False, elementCacheSize: int = 100000,
+        workers: int = 1, chunkSize: int = 50000, gridCache: bool = False, adaptive: AdaptiveStepController = None, **solverOptions) -> None:
     '''
     Runs all the necessary functions to calculate max and min temperature of the element in time.
+    Report of the instrumentation (timings of phases and steps) is printed at the end.
+
+    inputFilePath:      path to the grid file, if not given it is chosen in a file dialog
+    order:              number of integration points (per direction) used for local matrices
+    reportFilePath:     if given, report is saved to this JSON file instead of being printed
+    checkpointFilePath: if given, checkpoints are saved to this file every checkpointEverySteps steps and/or
+                        checkpointEverySeconds seconds, local matrices are cached next to it (see getLocalMatricesFilePath),
+                        so that a restart does not recalculate them
+                        (requires the store output format, which a restarted run appends to)
+    restart:            if True, the run continues from checkpointFilePath with its order and solver options
+    elementCacheSize:   size of ElementMatricesCache sharing local matrices of congruent elements, 0 disables it
+    workers:            if bigger than 1, local matrices and global matrices are calculated by ParallelAssembly
+                        in chunks of chunkSize elements (element cache and cached local matrices are not used then)
+    adaptive:           if given, step size is chosen by the controller instead of fixed SimulationStepTime (see simulateSteps)
+    gridCache:          if True, parsed grid is cached in Data/Cache and read back while the input file is unchanged (see Grid.createFromFile)
+    solverOptions:      keyword arguments passed to SystemOfEquations, initialTemps and tots can hold only a single case
     '''
+    instrumentation = instrumentation or Instrumentation()
     try:
-        inputFilePath: str = getInputFilePath()
-        grid = Grid.createFromFile(inputFilePath)
-        LocalMatricesCalculation.calculate(5, grid)
-        temperatures: list[float] = simulate(grid)
-        generateVtkFiles(inputFilePath, grid, temperatures)
+        inputFilePath = inputFilePath or getInputFilePath()
+        checkpoint: Checkpoint = None
+        if checkpointFilePath is not None and outputFormat != 'store':
+            raise FiniteElementMethodException('Checkpoints require the store output format, other formats cannot be resumed.')
+        if restart:
+            if checkpointFilePath is None:
+                raise FiniteElementMethodException('Restart requires a checkpoint file.')
+            checkpoint = Checkpoint.load(checkpointFilePath)
+            order, solverOptions = checkpoint.order, checkpoint.solverOptions
+            print(f'Restarting from {checkpointFilePath} at time {checkpoint.time}')
+        if any(values is not None and len(values) != 1 for values in (solverOptions.get('initialTemps'), solverOptions.get('tots'))):
+            raise FiniteElementMethodException('Output files hold a single case, use simulateCases to simulate several initialTemps/tots.')
+        instrumentation.start()
+        with instrumentation.phase('gridParsing'):
+            grid = Grid.createFromFile(inputFilePath, useCache=gridCache)
+        parallel = ParallelAssembly(workers, chunkSize) if workers > 1 else None
+        elementCache = ElementMatricesCache(elementCacheSize) if elementCacheSize and parallel is None else None
+        with instrumentation.phase('localMatrices'):
+            if parallel is not None:
+                LocalMatricesCalculation.calculate(order, grid, parallel=parallel)
+            elif checkpointFilePath is None:
+                LocalMatricesCalculation.calculate(order, grid, batched=True, cache=elementCache)
+            elif LocalMatricesCalculation.calculateCached(order, grid, getLocalMatricesFilePath(checkpointFilePath), elementCache):
+                print('Local matrices read from cache')
+        if elementCache is not None and elementCache.hits + elementCache.misses:
+            instrumentation.count('elementCacheHits', elementCache.hits)
+            instrumentation.count('elementCacheMisses', elementCache.misses)
+            print(f'Element matrices cache hit rate: {elementCache.hitRate:.1%} ({len(elementCache)} element shapes cached)')
+        checkpointWriter = None if checkpointFilePath is None else \
+            CheckpointWriter(checkpointFilePath, order, checkpointEverySteps, checkpointEverySeconds)
+        steps = simulateSteps(grid, instrumentation, adaptive, withTime=True, checkpointWriter=checkpointWriter, restart=checkpoint,
+                              assembly=parallel, **solverOptions)
+        generateVtkFiles(inputFilePath, grid, steps, outputFormat, instrumentation, outputDir, frameSelector, checkpoint)
+        instrumentation.stop()
+        if reportFilePath is None:
+            instrumentation.printReport()
+        else:
+            instrumentation.saveReport(reportFilePath)
     except FiniteElementMethodException as e:
+        instrumentation.stop()
         print(e)
 
+def main(args: list[str] = None) -> None:
+    '''
+    Command line entry point, the file dialog is opened only if no grid file is given.
+    '''
+    parser = argparse.ArgumentParser(description='Transient heat transfer simulation with the finite element method.')
+    parser.add_argument('grid', nargs='?', help='path to the grid file (file dialog is opened if omitted)')
+    parser.add_argument('--order', type=int, default=5, help='number of integration points per direction')
+    parser.add_argument('--output-dir', default=outputPath, help='directory for output files')
+    parser.add_argument('--format', choices=('vtu', 'vtk', 'store'), default='vtu', help='output file format')
+    parser.add_argument('--every', type=int, default=1, help='write every k-th time step only')
+    parser.add_argument('--times', type=float, nargs='+', help='write only steps reaching these times')
+    parser.add_argument('--dense', action='store_true', help='use dense instead of sparse global matrices')
+    parser.add_argument('--solver', choices=SystemOfEquations.solvers, default='direct')
+    parser.add_argument('--preconditioner', choices=SystemOfEquations.preconditioners, default='jacobi')
+    parser.add_argument('--tolerance', type=float, default=1e-6, help='pcg stops when the residual drops below this fraction of the right-hand side norm')
+    parser.add_argument('--max-iterations', type=int, default=1000, help='maximum number of pcg iterations in a single step')
+    parser.add_argument('--adaptive-tolerance', type=float, help='choose step sizes adaptively, keeping the local error (max temperature difference) below this value')
+    parser.add_argument('--min-step', type=float, help='the smallest step of adaptive stepping')
+    parser.add_argument('--max-step', type=float, help='the biggest step of adaptive stepping')
+    parser.add_argument('--integrator', choices=SystemOfEquations.integrators, default='implicit')
+    parser.add_argument('--lumped', action='store_true', help='use lumped C matrix')
+    parser.add_argument('--reorder', action='store_true', help='renumber nodes with reverse Cuthill-McKee algorithm')
+    parser.add_argument('--report', help='save report to this JSON file instead of printing it')
+    parser.add_argument('--profile', action='store_true', help='add cProfile statistics of the run to the report')
+    parser.add_argument('--trace-memory', action='store_true', help='add tracemalloc peak and top allocations to the report')
+    parser.add_argument('--workers', type=int, default=1, help='number of processes calculating local and global matrices')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='number of elements in a task of a worker process')
+    parser.add_argument('--grid-cache', action='store_true', help='cache the parsed grid in Data/Cache and reuse it while the grid file is unchanged')
+    parser.add_argument('--element-cache-size', type=int, default=100000, help='number of unique element shapes kept in cache (0 disables it)')
+    parser.add_argument('--checkpoint', help='checkpoint file')
+    parser.add_argument('--checkpoint-steps', type=int, help='save checkpoint every N steps')
+    parser.add_argument('--checkpoint-seconds', type=float, help='save checkpoint every T seconds of wall time')
+    parser.add_argument('--restart', action='store_true', help='continue from the checkpoint file (its order and solver options are used)')
+    arguments = parser.parse_args(args)
+    try:
+        frameSelector = FrameSelector(arguments.every, arguments.times)
+    except FiniteElementMethodException as e:
+        parser.error(str(e))
+    adaptive = None
+    if arguments.adaptive_tolerance is not None:
+        if arguments.min_step is None or arguments.max_step is None:
+            parser.error('--adaptive-tolerance requires --min-step and --max-step.')
+        try:
+            adaptive = AdaptiveStepController(arguments.adaptive_tolerance, arguments.min_step, arguments.max_step)
+        except FiniteElementMethodException as e:
+            parser.error(str(e))
+    elif arguments.min_step is not None or arguments.max_step is not None:
+        parser.error('--min-step and --max-step require --adaptive-tolerance.')
+    if arguments.restart and arguments.checkpoint is None:
+        parser.error('--restart requires --checkpoint.')
+    if arguments.checkpoint is not None and arguments.format != 'store':
+        parser.error('--checkpoint requires --format store.')
+    instrumentation = Instrumentation(profile=arguments.profile, traceMemory=arguments.trace_memory)
+    run(instrumentation=instrumentation, inputFilePath=arguments.grid, order=arguments.order, outputDir=arguments.output_dir, outputFormat=arguments.format,
+        frameSelector=frameSelector, reportFilePath=arguments.report, checkpointFilePath=arguments.checkpoint,
+        checkpointEverySteps=arguments.checkpoint_steps, checkpointEverySeconds=arguments.checkpoint_seconds, restart=arguments.restart,
+        elementCacheSize=arguments.element_cache_size, workers=arguments.workers, chunkSize=arguments.chunk_size, gridCache=arguments.grid_cache,
+        adaptive=adaptive, sparse=not arguments.dense, solver=arguments.solver, preconditioner=arguments.preconditioner, tolerance=arguments.tolerance,
+        maxIterations=arguments.max_iterations, integrator=arguments.integrator, lumped=arguments.lumped, reorder=arguments.reorder)
+
 if __name__ == '__main__':
-    run()
\ No newline at end of file
+    main()
@@ -0,0 +1,33 @@
+from checkpoint import Checkpoint
+from grid import Grid
+from local_matrices_calculation import LocalMatricesCalculation
+from temperature_simulation import run
+import numpy as np
+import os
+import pytest
+
+exampleGridPath = os.path.join(os.path.dirname(__file__), '..', 'Data', 'example_grid.txt')
+
+def test_checkpoint_saves_numpy_solver_options(tmp_path):
+    solverOptions = {'initialTemps': np.array([100.0, 200.0]), 'tots': np.array([1200.0, 1000.0]), 'tolerance': np.float64(1e-8)}
+    checkpoint = Checkpoint(np.zeros((4, 2)), 10.0, 5.0, 10.0, 2, 2, solverOptions, 'hash')
+    checkpoint.save(str(tmp_path / 'run.npz'))
+    loaded = Checkpoint.load(str(tmp_path / 'run.npz'))
+    assert loaded.solverOptions == {'initialTemps': [100.0, 200.0], 'tots': [1200.0, 1000.0], 'tolerance': 1e-8}
+
+@pytest.mark.parametrize('outputFormat', ['vtu', 'vtk'])
+def test_checkpoint_requires_store_format(tmp_path, capsys, outputFormat):
+    run(inputFilePath=exampleGridPath, outputDir=str(tmp_path), outputFormat=outputFormat,
+        checkpointFilePath=str(tmp_path / 'run.npz'), checkpointEverySteps=1)
+    assert 'Checkpoints require the store output format' in capsys.readouterr().out
+    assert not (tmp_path / 'run.npz').exists()
+
+def test_local_matrices_are_cached_next_to_checkpoint(tmp_path, capsys):
+    checkpointFilePath = str(tmp_path / 'run.npz')
+    for order in (2, 2, 3):
+        run(inputFilePath=exampleGridPath, order=order, outputDir=str(tmp_path / 'output'), outputFormat='store',
+            checkpointFilePath=checkpointFilePath, checkpointEverySteps=5)
+    assert capsys.readouterr().out.count('Local matrices read from cache') == 1
+    assert sorted(os.listdir(tmp_path)) == ['output', 'run.localMatrices.npz', 'run.npz']
+    grid = Grid.createFromFile(exampleGridPath)
+    assert LocalMatricesCalculation.calculateCached(3, grid, str(tmp_path / 'run.localMatrices.npz'))
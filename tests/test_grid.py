@@ -0,0 +1,25 @@
+from grid import Grid
+import os
+import shutil
+
+exampleGridPath = os.path.join(os.path.dirname(__file__), '..', 'Data', 'example_grid.txt')
+
+def test_purge_cache_keeps_grids_with_the_same_name(tmp_path):
+    cacheDir = str(tmp_path / 'cache')
+    for directory in ('a', 'b'):
+        os.makedirs(tmp_path / directory)
+        shutil.copy(exampleGridPath, tmp_path / directory / 'grid.txt')
+    Grid.createFromFile(str(tmp_path / 'a' / 'grid.txt'), useCache=True, cacheDir=cacheDir)
+    Grid.createFromFile(str(tmp_path / 'b' / 'grid.txt'), useCache=True, cacheDir=cacheDir)
+    assert len(os.listdir(cacheDir)) == 2
+    with open(tmp_path / 'a' / 'grid.txt', 'a') as f:
+        f.write('\n')
+    assert Grid.purgeCache(cacheDir, str(tmp_path / 'a' / 'grid.txt')) == 1
+    assert os.listdir(cacheDir) == [os.path.basename(Grid._getCacheFilePath(str(tmp_path / 'b' / 'grid.txt'), cacheDir))]
+
+def test_purge_cache_keeps_other_files(tmp_path):
+    (tmp_path / 'localMatrices-0123456789abcdef0123.npz').write_bytes(b'')
+    (tmp_path / 'grid-0123456789abcdef0123-v1.npz').write_bytes(b'')
+    (tmp_path / 'results.npz').write_bytes(b'')
+    assert Grid.purgeCache(str(tmp_path)) == 2
+    assert os.listdir(tmp_path) == ['results.npz']
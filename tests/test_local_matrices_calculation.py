@@ -0,0 +1,31 @@
+from grid_generator import GridGenerator
+from local_matrices_calculation import LocalMatricesCalculation, ElementMatricesCache
+import numpy as np
+import pytest
+
+def createGrid(perturbation: float = 0.0):
+    grid = GridGenerator.createRectangular(20, 20)
+    grid.nodeCoords[:] += np.random.default_rng(0).uniform(-perturbation, perturbation, grid.nodeCoords.shape)
+    return grid
+
+@pytest.mark.parametrize('perturbation', [0.0, 1e-5])
+def test_deduplicated_matches_batched(perturbation):
+    grid = createGrid(perturbation)
+    LocalMatricesCalculation.calculate(2, grid, batched=True)
+    expected = grid.getLocalMatrices()
+    LocalMatricesCalculation.calculate(2, grid, batched=True, cache=ElementMatricesCache())
+    for actual, reference in zip(grid.getLocalMatrices(), expected):
+        np.testing.assert_allclose(actual, reference, rtol=1e-9, atol=1e-9)
+
+def test_cache_is_skipped_for_unique_shapes():
+    cache = ElementMatricesCache()
+    LocalMatricesCalculation.calculate(2, createGrid(1e-5), batched=True, cache=cache)
+    assert (cache.hits, cache.misses, len(cache)) == (0, 400, 0)
+
+def test_cache_is_reused_between_calls():
+    cache = ElementMatricesCache()
+    LocalMatricesCalculation.calculate(2, createGrid(), batched=True, cache=cache)
+    uniqueShapes = len(cache)
+    assert cache.misses == uniqueShapes < 400
+    LocalMatricesCalculation.calculate(2, createGrid(), batched=True, cache=cache)
+    assert cache.misses == uniqueShapes and cache.hits == 800 - uniqueShapes
@@ -0,0 +1,40 @@
+from grid_generator import GridGenerator
+from local_matrices_calculation import LocalMatricesCalculation
+from parallel_assembly import ParallelAssembly
+from system_of_equations import SystemOfEquations
+import numpy as np
+import pytest
+
+def createGrid():
+    grid = GridGenerator.createRectangular(12, 9)
+    grid.nodeCoords[:] += np.random.default_rng(0).uniform(-1e-4, 1e-4, grid.nodeCoords.shape)
+    return grid
+
+def assertSameSystem(actual: SystemOfEquations, expected: SystemOfEquations):
+    np.testing.assert_allclose(actual.H.toarray(), expected.H.toarray(), rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(actual.C.toarray(), expected.C.toarray(), rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(actual.P, expected.P, rtol=1e-12, atol=1e-12)
+
+@pytest.mark.parametrize('workers', [1, 2])
+@pytest.mark.parametrize('reorder', [False, True])
+def test_parallel_assembly_matches_serial(workers, reorder):
+    expectedGrid = createGrid()
+    LocalMatricesCalculation.calculate(2, expectedGrid, batched=True)
+    expected = SystemOfEquations(expectedGrid, sparse=True, reorder=reorder)
+    grid = createGrid()
+    parallel = ParallelAssembly(workers, chunkSize=25)
+    LocalMatricesCalculation.calculate(2, grid, parallel=parallel)
+    for actual, reference in zip(grid.getLocalMatrices(), expectedGrid.getLocalMatrices()):
+        np.testing.assert_allclose(actual, reference, rtol=1e-12, atol=1e-12)
+    assertSameSystem(SystemOfEquations(grid, sparse=True, reorder=reorder, assembly=parallel), expected)
+    # local matrices assembled by the same tasks are used once, later calls assemble them again
+    assert parallel._assembled is None
+    assertSameSystem(SystemOfEquations(grid, sparse=True, reorder=reorder, assembly=parallel), expected)
+
+def test_replaced_local_matrices_are_assembled_again():
+    grid = createGrid()
+    parallel = ParallelAssembly(1, chunkSize=25)
+    LocalMatricesCalculation.calculate(2, grid, parallel=parallel)
+    grid.P = 2*grid.P
+    H, C, P = parallel.assemble(grid)
+    np.testing.assert_allclose(P, SystemOfEquations.assembleVector(grid.connectivity, grid.P, len(grid.nodeCoords)))
@@ -0,0 +1,86 @@
+from grid_generator import GridGenerator
+from result_store import ResultStore
+import numpy as np
+import os
+import pytest
+
+@pytest.fixture
+def grid():
+    return GridGenerator.createRectangular(3, 2)
+
+def createStore(filePath: str, grid, steps: int, dtype: type = np.float64) -> np.ndarray:
+    '''
+    Creates store with the given number of steps (time 10*(i + 1)) and returns their (steps, nodes) temperatures.
+    '''
+    temperatures = np.arange(steps*len(grid.nodeCoords), dtype=float).reshape(steps, -1) + 100
+    store = ResultStore.create(filePath, grid, dtype)
+    for i, stepTemperatures in enumerate(temperatures):
+        store.append(10*(i + 1), stepTemperatures.reshape(-1, 1))
+    store.close()
+    return temperatures
+
+@pytest.mark.parametrize('dtype', [np.float64, np.float32])
+def test_store_round_trip(tmp_path, grid, dtype):
+    filePath = str(tmp_path / 'results.femres')
+    temperatures = createStore(filePath, grid, 4, dtype)
+    store = ResultStore.open(filePath)
+    assert len(store) == 4
+    np.testing.assert_array_equal(store.times, [10, 20, 30, 40])
+    np.testing.assert_array_equal(store.temperatures, temperatures.astype(dtype))
+    np.testing.assert_array_equal(store.frame(2), temperatures[2].astype(dtype))
+    np.testing.assert_array_equal(store.nodeHistory(5), temperatures[:, 5].astype(dtype))
+    np.testing.assert_array_equal(store.nodeHistory(5, slice(1, 3)), temperatures[1:3, 5].astype(dtype))
+    np.testing.assert_array_equal(store.getNodeCoords(), grid.getNodeCoords())
+    np.testing.assert_array_equal(store.getConnectivity(), grid.getConnectivity())
+    np.testing.assert_array_equal(store.getBcMask(), grid.getBcMask())
+    assert store.createGrid().getMeshHash() == grid.getMeshHash()
+    # sections read independently of ResultStore: header, then 64-byte aligned node coords, connectivity, mask and records
+    with open(filePath, 'rb') as file:
+        content = file.read()
+    assert content[:8] == ResultStore.magic
+    offset = 16 + int(np.frombuffer(content[8:16], dtype='<u8')[0])
+    sections = []
+    for size in (16*len(grid.nodeCoords), 32*len(grid.connectivity), len(grid.nodeCoords)):
+        offset = -(-offset // 64)*64
+        sections.append(content[offset:offset + size])
+        offset += size
+    offset = -(-offset // 64)*64
+    np.testing.assert_array_equal(np.frombuffer(sections[0], dtype='<f8').reshape(-1, 2), grid.getNodeCoords())
+    np.testing.assert_array_equal(np.frombuffer(sections[1], dtype='<i8').reshape(-1, 4), grid.getConnectivity())
+    np.testing.assert_array_equal(np.frombuffer(sections[2], dtype='u1').astype(bool), grid.getBcMask())
+    recordSize = 8 + len(grid.nodeCoords)*np.dtype(dtype).itemsize
+    assert len(content) == offset + 4*recordSize
+    assert np.frombuffer(content[offset + recordSize:offset + recordSize + 8], dtype='<f8')[0] == 20
+    np.testing.assert_array_equal(np.frombuffer(content[offset + recordSize + 8:offset + 2*recordSize], dtype=np.dtype(dtype).newbyteorder('<')),
+                                  temperatures[1].astype(dtype))
+
+def test_store_exports_vtk(tmp_path, grid):
+    filePath = str(tmp_path / 'results.femres')
+    temperatures = createStore(filePath, grid, 3)
+    store = ResultStore.open(filePath)
+    paths = store.exportVtk(str(tmp_path / 'vtu'), steps=[0, 2])
+    assert [os.path.basename(path) for path in paths] == ['frame1.vtu', 'frame2.vtu']
+    with open(tmp_path / 'vtu' / 'temperatures.pvd', encoding='utf-8') as file:
+        collection = file.read()
+    assert 'timestep="10.0"' in collection and 'timestep="30.0"' in collection
+    paths = store.exportVtk(str(tmp_path / 'vtk'), steps=slice(1, None), outputFormat='vtk')
+    assert len(paths) == 2
+    with open(paths[-1], encoding='utf-8') as file:
+        lines = file.read().split('LOOKUP_TABLE default\n')[1].split()
+    np.testing.assert_allclose([float(value) for value in lines], temperatures[2])
+
+def test_store_resume_drops_later_steps_and_partial_record(tmp_path, grid):
+    filePath = str(tmp_path / 'results.femres')
+    temperatures = createStore(filePath, grid, 5)
+    with open(filePath, 'ab') as file:
+        file.write(b'\0'*11)
+    # incomplete last record is ignored by readers
+    assert len(ResultStore.open(filePath)) == 5
+    store = ResultStore.resume(filePath, endTime=30)
+    store.append(40, temperatures[0] + 1)
+    store.close()
+    store = ResultStore.open(filePath)
+    np.testing.assert_array_equal(store.times, [10, 20, 30, 40])
+    np.testing.assert_array_equal(store.temperatures[:3], temperatures[:3])
+    np.testing.assert_array_equal(store.frame(3), temperatures[0] + 1)
+    assert os.path.getsize(filePath) == store._offsets['records'] + 4*store._recordType.itemsize
@@ -0,0 +1,78 @@
+from common import FiniteElementMethodException
+from grid_generator import GridGenerator
+from local_matrices_calculation import LocalMatricesCalculation
+from system_of_equations import SystemOfEquations, AdaptiveStepController, IncompleteCholesky
+import numpy as np
+import pytest
+from scipy import sparse
+
+@pytest.fixture(scope='module')
+def grid():
+    grid = GridGenerator.createRectangular(150, 150)
+    LocalMatricesCalculation.calculate(2, grid, batched=True)
+    return grid
+
+def test_ic_preconditioner_is_symmetric(grid):
+    soe = SystemOfEquations(grid, sparse=True, solver='pcg', preconditioner='ic')
+    H = soe.H + soe.C/soe.step
+    applyPreconditioner = soe._createPreconditioner(H)
+    rng = np.random.default_rng(0)
+    e, f = rng.random(soe.dim), rng.random(soe.dim)
+    assert abs(e @ applyPreconditioner(f) - f @ applyPreconditioner(e)) < 1e-8*(e @ applyPreconditioner(e))
+    assert e @ applyPreconditioner(e) > 0
+
+def test_ic_factor_matches_matrix_on_its_pattern(grid):
+    soe = SystemOfEquations(grid, sparse=True)
+    H = sparse.csr_matrix(soe.H + soe.C/soe.step)
+    analysis = IncompleteCholesky(H)
+    L = analysis.factorize(H)
+    lower = sparse.tril(H, format='csr')
+    assert np.array_equal(L.indptr, lower.indptr) and np.array_equal(L.indices, lower.indices)
+    residual = sparse.csr_matrix(L @ L.T - H).multiply(lower != 0)
+    assert abs(residual).max() < 1e-12*abs(H).max()
+    assert analysis.matches(soe.H + soe.C/(2*soe.step))
+
+def test_ic_preconditioned_pcg_converges_on_large_grid(grid):
+    direct = SystemOfEquations(grid, sparse=True)
+    pcg = SystemOfEquations(grid, sparse=True, solver='pcg', preconditioner='ic', tolerance=1e-10)
+    jacobi = SystemOfEquations(grid, sparse=True, solver='pcg', preconditioner='jacobi', tolerance=1e-10)
+    for _ in range(3):
+        expected = direct.solve()
+        np.testing.assert_allclose(pcg.solve(), expected, rtol=1e-7)
+        jacobi.solve()
+    assert all(ic < j for ic, j in zip(pcg.iterations, jacobi.iterations))
+
+def test_ic_preconditioned_pcg_warm_steps(grid):
+    direct = SystemOfEquations(grid, sparse=True)
+    pcg = SystemOfEquations(grid, sparse=True, solver='pcg', preconditioner='ic')
+    for _ in range(5):
+        expected = direct.solve()
+        np.testing.assert_allclose(pcg.solve(), expected, rtol=1e-5)
+    # steps start from the previous temperatures, so they need fewer iterations than the first one
+    assert pcg.iterations[0] < 75
+    assert all(iterations <= pcg.iterations[0] for iterations in pcg.iterations[1:])
+    assert pcg.iterations[-1] < 60
+
+def test_adaptive_step_respects_bounds():
+    controller = AdaptiveStepController(1.0, minStep=20, maxStep=40)
+    assert controller.nextStep(25, 2.0) == (False, 20)
+    assert controller.nextStep(20, 2.0) == (True, 20)
+    assert controller.nextStep(30, 0.1) == (True, 40)
+    assert controller.nextStep(100, 0.5) == (True, 40)
+
+def test_adaptive_first_step_is_clamped():
+    grid = GridGenerator.createRectangular(4, 4)
+    LocalMatricesCalculation.calculate(2, grid, batched=True)
+    soe = SystemOfEquations(grid)
+    controller = AdaptiveStepController(1e9, minStep=1, maxStep=10)
+    times = []
+    for _ in range(3):
+        soe.solveAdaptive(controller)
+        times.append(soe.dTau)
+    assert times == [10, 20, 30]
+
+def test_explicit_integrator_rejects_pcg():
+    grid = GridGenerator.createRectangular(4, 4)
+    LocalMatricesCalculation.calculate(2, grid, batched=True)
+    with pytest.raises(FiniteElementMethodException):
+        SystemOfEquations(grid, solver='pcg', integrator='explicit')
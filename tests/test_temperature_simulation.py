@@ -0,0 +1,50 @@
+from common import FiniteElementMethodException
+from grid import Grid
+from result_store import ResultStore
+from temperature_simulation import main, run
+from vtk_writer import VtkTemplateWriter
+import json
+import numpy as np
+import os
+import pytest
+
+exampleGridPath = os.path.join(os.path.dirname(__file__), '..', 'Data', 'example_grid.txt')
+
+@pytest.mark.parametrize('outputFormat', ['vtu', 'vtk', 'store'])
+def test_run_rejects_several_cases(tmp_path, capsys, outputFormat):
+    run(inputFilePath=exampleGridPath, outputDir=str(tmp_path), outputFormat=outputFormat, initialTemps=[100, 200], sparse=True)
+    assert 'Output files hold a single case' in capsys.readouterr().out
+    assert os.listdir(tmp_path) == []
+
+def test_run_accepts_single_case(tmp_path):
+    run(inputFilePath=exampleGridPath, outputDir=str(tmp_path), outputFormat='store', initialTemps=[150], tots=[1000])
+    assert os.path.isfile(tmp_path / 'example_grid' / 'results.femres')
+
+def test_vtk_template_writer_rejects_several_cases(tmp_path):
+    grid = Grid.createFromFile(exampleGridPath)
+    writer = VtkTemplateWriter(str(tmp_path), grid)
+    writer.writeFrame(np.arange(16.0))
+    with pytest.raises(FiniteElementMethodException):
+        writer.writeFrame(np.zeros((16, 2)))
+
+def test_main_enables_profiling_and_memory_tracing(tmp_path):
+    reportFilePath = tmp_path / 'report.json'
+    main([exampleGridPath, '--output-dir', str(tmp_path), '--report', str(reportFilePath), '--profile', '--trace-memory'])
+    report = json.loads(reportFilePath.read_text())
+    assert 'cumulative' in report['profile']
+    assert report['memory']['peak'] > 0
+
+def test_main_passes_adaptive_and_solver_options(tmp_path):
+    main([exampleGridPath, '--output-dir', str(tmp_path), '--format', 'store', '--solver', 'pcg', '--max-iterations', '50',
+          '--adaptive-tolerance', '5', '--min-step', '5', '--max-step', '200'])
+    times = ResultStore.open(str(tmp_path / 'example_grid' / 'results.femres')).times
+    assert len(set(np.round(np.diff(times), 6))) > 1
+    assert np.all(np.diff(times) >= 5) and np.all(np.diff(times) <= 200)
+
+def test_main_rejects_step_bounds_without_adaptive_tolerance(tmp_path):
+    with pytest.raises(SystemExit):
+        main([exampleGridPath, '--output-dir', str(tmp_path), '--min-step', '5'])
+
+def test_main_passes_max_iterations(tmp_path, capsys):
+    main([exampleGridPath, '--output-dir', str(tmp_path), '--solver', 'pcg', '--max-iterations', '1'])
+    assert 'did not converge in 1 iterations' in capsys.readouterr().out
@@ -0,0 +1,41 @@
+from grid_generator import GridGenerator
+from vtk_writer import VtuWriter
+import numpy as np
+import pytest
+import re
+
+def readAppendedArrays(filePath: str) -> dict:
+    '''
+    Returns name -> (type, raw bytes) of appended data arrays of .vtu file, blocks are located by their offset attributes.
+    '''
+    with open(filePath, 'rb') as file:
+        content = file.read()
+    dataStart = content.index(b'<AppendedData encoding="raw">')
+    dataStart = content.index(b'_', dataStart) + 1
+    header = content[:dataStart].decode('ascii')
+    arrays: dict = {}
+    for attributes in re.findall(r'<DataArray ([^>]*)/>', header):
+        attributes = dict(re.findall(r'(\w+)="([^"]*)"', attributes))
+        offset = dataStart + int(attributes['offset'])
+        size = int(np.frombuffer(content[offset:offset + 8], dtype='<u8')[0])
+        arrays[attributes.get('Name', 'Points')] = (attributes['type'], content[offset + 8:offset + 8 + size])
+    assert content.endswith(b'\n  </AppendedData>\n</VTKFile>\n')
+    return arrays
+
+@pytest.mark.parametrize('dtype, vtkType', [(np.float64, 'Float64'), (np.float32, 'Float32')])
+def test_vtu_appended_offsets(tmp_path, dtype, vtkType):
+    grid = GridGenerator.createRectangular(4, 3)
+    writer = VtuWriter(str(tmp_path), grid.getNodeCoords(), grid.getConnectivity(), dtype=dtype)
+    temperatures = np.linspace(100, 1200, len(grid.nodeCoords))
+    writer.writeFrame(temperatures)
+    filePath = writer.writeFrame(temperatures + 1)
+    arrays = readAppendedArrays(filePath)
+    assert sorted(arrays) == ['Points', 'Temp', 'connectivity', 'offsets', 'types']
+    assert arrays['Temp'][0] == vtkType
+    np.testing.assert_array_equal(np.frombuffer(arrays['Temp'][1], dtype=np.dtype(dtype).newbyteorder('<')), (temperatures + 1).astype(dtype))
+    points = np.frombuffer(arrays['Points'][1], dtype='<f8').reshape(-1, 3)
+    np.testing.assert_array_equal(points[:, :2], grid.getNodeCoords())
+    np.testing.assert_array_equal(points[:, 2], 0)
+    np.testing.assert_array_equal(np.frombuffer(arrays['connectivity'][1], dtype='<i8').reshape(-1, 4), grid.getConnectivity())
+    np.testing.assert_array_equal(np.frombuffer(arrays['offsets'][1], dtype='<i8'), 4*np.arange(1, len(grid.connectivity) + 1))
+    np.testing.assert_array_equal(np.frombuffer(arrays['types'][1], dtype='u1'), VtuWriter.cellType)
@@ -1,21 +1,24 @@
 from common import *
-from numerical_integration import GaussianQuadrature
+from numerical_integration import GaussianQuadrature, gaussLegendre
+from functools import lru_cache
 from math import *
+import numpy as np
 
 class UniversalElement(GaussianQuadrature):
     '''
     Contains all the calculations that are universal for every 4-node element.
+    Tables are read-only numpy arrays, memoized per number of integration points.
     
     dNdKsiTab:      table of dN/dKsi results for N1, N2, N3, N4 in integration points (n^2x4)
     dNdEtaTab:      table of dN/dEta results for N1, N2, N3, N4 in integration points (n^2x4)
-    NTab:           table of N(ksi, eta) values for N1, N2, N3, N4 in integration points (nx4)
+    NTab:           table of N(ksi, eta) values for N1, N2, N3, N4 in integration points (n^2x4)
     surfaces:       list of Surface type elements, necessary for calculations that take border conditions into account
     '''
     def __init__(self, n):
         super().__init__(n, None)
-        self.dNdKsiTab: list[list[float]] = []
-        self.dNdEtaTab: list[list[float]] = []
-        self.NTab: list[list[float]] = []
+        self.dNdKsiTab: np.ndarray = None
+        self.dNdEtaTab: np.ndarray = None
+        self.NTab: np.ndarray = None
         self.surfaces: list[Surface] = [
             Surface(n), # down
             Surface(n), # right
@@ -25,77 +28,49 @@ class UniversalElement(GaussianQuadrature):
         self.fillTabs()
 
     def fillTabs(self):
-        def initialize():       
-            '''
-            Initializes empty tables.
-            '''
-            for i in range(self.n*self.n):
-                self.dNdKsiTab.append([])
-                self.dNdEtaTab.append([])
-                self.NTab.append([])
-                for _ in range (0, 4):
-                    self.dNdKsiTab[i].append(0)
-                    self.dNdEtaTab[i].append(0)
-                    self.NTab[i].append(0)
-
-        def filldNdKsidNdEtaTabs():  
-            '''
-            Calculates dN/dKsi and dN/dEta for N1, N2, N3, N4 in integration points. Result is stored in tables.
-            '''
-            for j in range(self.n*self.n):
-                ksi = self.points[j%self.n]
-                eta = self.points[j//self.n]
-                for i in range (0, 4):
-                    self.dNdKsiTab[j][i] = dNdKsiFunTab[i](eta)
-                    self.dNdEtaTab[j][i] = dNdEtaFunTab[i](ksi)
-                    self.NTab[j][i] = NFunTab[i](ksi, eta)
-
-        def fillSurfaceTab():
-            '''
-            Calculates integration points coords for surface calculations.
-            '''
-            for i in range(0, len(self.surfaces)):
-                ksiList = []
-                etaList = []
-                if i % 2 == 0:
-                    ksiList = self.points
-                    for _ in range(0, self.n):
-                        etaList.append(i - 1)
-                else:
-                    etaList = self.points
-                    for _ in range(0, self.n):
-                        ksiList.append(2 - i)
-                self.surfaces[i].fillN(ksiList, etaList)
-
-        initialize()
-        filldNdKsidNdEtaTabs()
-        fillSurfaceTab()
+        '''
+        Fills tables with memoized values for the number of integration points.
+        '''
+        self.dNdKsiTab, self.dNdEtaTab, self.NTab, surfacesN = referenceTables(self.n)
+        for surface, N in zip(self.surfaces, surfacesN):
+            surface.N = N
+
+@lru_cache(maxsize=None)
+def referenceTables(n: int) -> tuple:
+    '''
+    Calculates dN/dKsi, dN/dEta and N for N1, N2, N3, N4 in integration points (n^2x4)
+    and N in integration points of every surface (nx4). Returns read-only arrays.
+    '''
+    points, _ = gaussLegendre(n)
+    # integration point j has ksi = points[j%n] and eta = points[j//n]
+    ksi = np.tile(points, n)
+    eta = np.repeat(points, n)
+    dNdKsiTab = np.column_stack([fun(eta) for fun in dNdKsiFunTab])
+    dNdEtaTab = np.column_stack([fun(ksi) for fun in dNdEtaFunTab])
+    NTab = np.column_stack([fun(ksi, eta) for fun in NFunTab])
+
+    surfacesN = []
+    for i in range(0, 4):
+        if i % 2 == 0:
+            surfaceKsi, surfaceEta = points, np.full(n, i - 1.0)
+        else:
+            surfaceKsi, surfaceEta = np.full(n, 2.0 - i), points
+        surfacesN.append(np.column_stack([fun(surfaceKsi, surfaceEta) for fun in NFunTab]))
+
+    tables = (dNdKsiTab, dNdEtaTab, NTab, tuple(surfacesN))
+    for table in (dNdKsiTab, dNdEtaTab, NTab, *surfacesN):
+        table.flags.writeable = False
+    return tables
 
 class Surface():
     '''
     Describes the surface of the universal element.
     n:      number of integration points
-    N:      table of N(ksi, eta) for N1, N2, N3, N4 and for each integration point on the surface
+    N:      table of N(ksi, eta) for N1, N2, N3, N4 and for each integration point on the surface (nx4)
     '''
     def __init__(self, n: int):
         self.n = n
-        self.N = []
-
-    def fillN(self, ksiList: list[float], etaList: list[float]):
-        '''
-        Calculates N(ksi, eta) for N1, N2, N3, N4 and for each integration point on the surface
-        Results are stored in the table
-        '''
-        def initializeN():
-            for i in range (0, self.n):
-                self.N.append([])
-                for _ in range (0, 4):
-                    self.N[i].append(0)
-                    
-        initializeN()
-        for j in range(0, len(ksiList)):
-            for i in range(0, 4):
-                self.N[j][i] = NFunTab[i](ksiList[j], etaList[j])
+        self.N: np.ndarray = None
 
 def N1(ksi: float, eta: float) -> float:
     return (1/4)*(1-ksi)*(1-eta)
@@ -0,0 +1,142 @@
+from common import *
+import numpy as np
+
+class VtkTemplateWriter:
+    '''
+    Writes temperatures to ASCII legacy VTK files rendered from temperatures.vtk.jinja template.
+
+    destinationDir:     directory for output files
+    data:               data passed to the template
+    frames:             list of (time, filename) of written frames
+    '''
+    def __init__(self, destinationDir: str, grid):
+        elementNodesNumber: list[int] = [grid.connectivity.shape[1]]*len(grid.connectivity)
+
+        self.destinationDir: str = destinationDir
+        self.data: dict = {}
+        self.data['nodesNumber']: int = grid.globalData.nodesNumber
+        self.data['nodes']: list = grid.nodes
+        self.data['elementsNumber']: int = grid.globalData.elementsNumber
+        self.data['elements']: list = grid.elements
+        self.data['elementNodesNumber']: int = elementNodesNumber
+        self.data['sumOfElementsData']: int = grid.globalData.elementsNumber + sum(elementNodesNumber)
+        self.frames: list[tuple[float, str]] = []
+        self._template = initializeJinjaEnvironment('temperatures.vtk.jinja')
+
+    def writeFrame(self, temperatures: np.ndarray, time: float = None) -> str:
+        '''
+        Writes temperatures of a single time step to frameN.vtk file and returns its path.
+        '''
+        filename: str = f'frame{len(self.frames) + 1}.vtk'
+        temperatures = np.reshape(temperatures, (self.data['nodesNumber'], -1))
+        if temperatures.shape[1] != 1:
+            raise FiniteElementMethodException(f'Expected temperatures of a single case, got {temperatures.shape[1]} cases.')
+        self.data['temperatures']: np.ndarray = temperatures
+        generateFile(self.data, self._template, self.destinationDir, filename)
+        self.frames.append((len(self.frames) + 1 if time is None else time, filename))
+        return os.path.join(self.destinationDir, filename)
+
+    def close(self) -> None:
+        pass
+
+class VtuWriter:
+    '''
+    Writes temperatures to binary XML VTK files (.vtu) with raw appended data and, optionally, a .pvd collection listing them.
+    Geometry is encoded once, every frame only adds packed temperature block in front of it.
+
+    destinationDir:     directory for output files
+    nodesNumber:        number of points
+    elementsNumber:     number of cells
+    dtype:              float type of temperatures, np.float32 or np.float64
+    frames:             list of (time, filename) of written frames
+    '''
+    cellType: int = 9 # VTK_QUAD
+
+    def __init__(self, destinationDir: str, nodeCoords: np.ndarray, connectivity: np.ndarray, dtype: type = np.float64, collection: bool = True):
+        self.destinationDir: str = destinationDir
+        self.nodesNumber: int = len(nodeCoords)
+        self.elementsNumber: int = len(connectivity)
+        self.dtype: np.dtype = np.dtype(dtype).newbyteorder('<')
+        self.collection: bool = collection
+        self.frames: list[tuple[float, str]] = []
+        self._header, self._geometry = self._encodeGeometry(nodeCoords, connectivity)
+
+    def _encodeGeometry(self, nodeCoords: np.ndarray, connectivity: np.ndarray) -> tuple[bytes]:
+        '''
+        Returns XML header and appended geometry blocks (points, connectivity, offsets, types).
+        Temperature block goes first, so offsets of geometry blocks are the same in every frame.
+        '''
+        points = np.zeros((self.nodesNumber, 3), dtype='<f8')
+        points[:, :2] = nodeCoords
+        blocks = [
+            points,
+            np.ascontiguousarray(connectivity, dtype='<i8'),
+            np.arange(4, 4*self.elementsNumber + 1, 4, dtype='<i8'),
+            np.full(self.elementsNumber, VtuWriter.cellType, dtype='u1')
+        ]
+        offsets = []
+        offset = 8 + self.nodesNumber*self.dtype.itemsize
+        geometry = bytearray()
+        for block in blocks:
+            offsets.append(offset)
+            geometry += VtuWriter._encodeBlock(block)
+            offset += 8 + block.nbytes
+        temperatureType = 'Float32' if self.dtype.itemsize == 4 else 'Float64'
+        header = (
+            '<?xml version="1.0"?>\n'
+            '<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n'
+            '  <UnstructuredGrid>\n'
+            f'    <Piece NumberOfPoints="{self.nodesNumber}" NumberOfCells="{self.elementsNumber}">\n'
+            '      <PointData Scalars="Temp">\n'
+            f'        <DataArray type="{temperatureType}" Name="Temp" format="appended" offset="0"/>\n'
+            '      </PointData>\n'
+            '      <Points>\n'
+            f'        <DataArray type="Float64" NumberOfComponents="3" format="appended" offset="{offsets[0]}"/>\n'
+            '      </Points>\n'
+            '      <Cells>\n'
+            f'        <DataArray type="Int64" Name="connectivity" format="appended" offset="{offsets[1]}"/>\n'
+            f'        <DataArray type="Int64" Name="offsets" format="appended" offset="{offsets[2]}"/>\n'
+            f'        <DataArray type="UInt8" Name="types" format="appended" offset="{offsets[3]}"/>\n'
+            '      </Cells>\n'
+            '    </Piece>\n'
+            '  </UnstructuredGrid>\n'
+            '  <AppendedData encoding="raw">\n'
+            '   _'
+        )
+        return header.encode('ascii'), bytes(geometry)
+
+    @staticmethod
+    def _encodeBlock(block: np.ndarray) -> bytes:
+        '''
+        Returns raw block preceded by its size in bytes (UInt64).
+        '''
+        return np.array([block.nbytes], dtype='<u8').tobytes() + block.tobytes()
+
+    def writeFrame(self, temperatures: np.ndarray, time: float = None) -> str:
+        '''
+        Writes temperatures of a single time step to frameN.vtu file and returns its path.
+        '''
+        filename: str = f'frame{len(self.frames) + 1}.vtu'
+        temperatureBlock = np.ascontiguousarray(np.ravel(temperatures), dtype=self.dtype)
+        if len(temperatureBlock) != self.nodesNumber:
+            raise FiniteElementMethodException(f'Expected {self.nodesNumber} temperatures, got {len(temperatureBlock)}.')
+        outputFilepath = os.path.join(self.destinationDir, filename)
+        with open(outputFilepath, mode='wb') as file:
+            file.write(self._header)
+            file.write(VtuWriter._encodeBlock(temperatureBlock))
+            file.write(self._geometry)
+            file.write(b'\n  </AppendedData>\n</VTKFile>\n')
+        self.frames.append((len(self.frames) + 1 if time is None else time, filename))
+        return outputFilepath
+
+    def close(self, collectionName: str = 'temperatures.pvd') -> None:
+        '''
+        Writes .pvd collection referencing all written frames (if collection is enabled).
+        '''
+        if not self.collection:
+            return
+        with open(os.path.join(self.destinationDir, collectionName), mode='w', encoding='utf-8') as file:
+            file.write('<?xml version="1.0"?>\n<VTKFile type="Collection" version="1.0" byte_order="LittleEndian">\n  <Collection>\n')
+            for time, filename in self.frames:
+                file.write(f'    <DataSet timestep="{time}" part="0" file="{filename}"/>\n')
+            file.write('  </Collection>\n</VTKFile>\n')